@@ -1,13 +1,21 @@
-import configparser
+import time
+STARTUP_TIME = time.perf_counter()
+
+import importlib
 import tkinter as tk
 from tkinter import messagebox, ttk
 import json
+import os
 from app_configurator import AppConfigurator
-import pygsheets
-import utils
-import pandastable as pdt
-import pandas as pd
 from connection import GoogleConnection, WhatsAppConnection
+import settings
+from tasks import TaskRunner
+IMPORTS_TIME = time.perf_counter()
+
+# Modules slow to import (pandas, the Google and PDF libraries).
+# They are imported in the background after the window is shown, and then
+# imported locally by the methods using them.
+DEFERRED_MODULES = ["pandas", "table_view", "search", "tables", "phones", "utils", "map_renderer", "store", "worksheet_cache", "outbox", "whatsapp"]
 
 # TODO-FIX: get data works despite google api not connected - CHECK
 
@@ -16,39 +24,59 @@ class App(tk.Tk):
     def __init__(self):
         super().__init__()
         self.title("FDB Post Reservation")
-        self.geometry("1000x600")
-
-        self.settings = self.load_settings()
+        self.geometry("1300x600")
+
+        # Parsed once, reloaded only when the file changes.
+        self.settings = settings.Settings('settings.ini')
+        # Downloaded data of each day, to switch between days without downloading again.
+        self.day_data = {}
+        # Search index of each day, updated when its data is shown.
+        self.search_indexes = {}
+        # Tables of the shown day, with the double bookings found.
+        self.table_assignments = None
+        # Tables of each day parsed by check_tables(): day -> (df, TableAssignments).
+        self.day_assignments = {}
+        # Created by finish_startup(), once the deferred modules are loaded.
+        self.df_table = None
+        self.worksheet_cache = None
+        self.store = None
+        self.outbox = None
+        self.startup_times = {"imports": IMPORTS_TIME - STARTUP_TIME}
+        status_ttl = self.settings.get_int("API", "status_ttl", 60)
         self.google_connection = GoogleConnection(
-            creds_file=self.settings.get("API").get("google_cred_file"),
-            token_file=self.settings.get("API").get("google_token_file"))
+            creds_file=self.settings.get_str("API", "google_cred_file"),
+            token_file=self.settings.get_str("API", "google_token_file"),
+            status_ttl=status_ttl)
         self.whatsapp_connection = WhatsAppConnection(
-            token_file=self.settings.get("API").get("whatsapp_token_file"),
-            phone_number_key="iliad")
+            token_file=self.settings.get_str("API", "whatsapp_token_file"),
+            phone_number_key="iliad",
+            status_ttl=status_ttl)
+        self.settings.subscribe(self.on_settings_changed)
+        self.configurator = None
+
+        # Worker pool for network and PDF operations
+        self.task_runner = TaskRunner(self)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
 
         # Create widgets
         self.create_widgets()
 
-        # Fill with the data
+        # Fill with the data, the connections are checked in the background
         self.update_ui()
 
-        # self.config = self.load_config()
+        # Load the slow modules and the saved data after the first paint
+        self.after_idle(self.report_first_paint)
+        # Not cancellable: without it the table and the actions never get ready.
+        self.run_task("startup", self.load_modules, on_done=lambda _: self.finish_startup(), cancellable=False)
+
         # self.secrets = self.load_secrets()
-        # self.configurator = None
 
         # if not self.secrets:
         #     self.destroy()
         #     return
 
-        # if not self.config:
-        #     self.configure_options()
-
         # self.create_status_widgets()
 
-        # Create a button for configuring options
-        # self.configure_button = tk.Button(self, text="Configure Options", command=self.configure_options)
-        # self.configure_button.pack()
-
     def create_widgets(self) -> None:
 
         self.grid_columnconfigure(0, weight=1)
@@ -89,10 +117,12 @@ class App(tk.Tk):
         settings_frame = tk.LabelFrame(self, text="Settings")
         settings_frame.grid(row=0, column=1, padx=10, pady=5, sticky="nsew")
 
-        self.test_label = tk.Label(settings_frame, text=self.settings["Other"]["message"], anchor="w", width=15)
+        self.test_label = tk.Label(settings_frame, text=self.settings.get_str("Other", "message"), anchor="w", width=15)
         self.test_label.pack(padx=10, pady=5, anchor='w')
         settings_button = tk.Button(settings_frame, text='Settings', command=self.open_settings_window)
-        settings_button.pack(pady=10, anchor='e')
+        settings_button.pack(side="right", pady=10, anchor='e')
+        days_button = tk.Button(settings_frame, text='Days', command=self.configure_options)
+        days_button.pack(side="right", padx=(0,10), pady=10, anchor='e')
 
         # Select day (dropdown)
         get_data_frame = tk.Frame(self)
@@ -103,30 +133,76 @@ class App(tk.Tk):
         self.day_combobox.pack(side="left", padx=(10,0), pady=5)
         self.day_combobox.bind("<<ComboboxSelected>>", self.on_combobox_selected)
 
+        # Search box, filters the table as you type
+        search_label = tk.Label(get_data_frame, text="Search:")
+        search_label.pack(side="left", padx=(20,10), pady=5)
+        self.search_var = tk.StringVar()
+        self.search_var.trace_add("write", lambda *args: self.on_search())
+        search_entry = tk.Entry(get_data_frame, textvariable=self.search_var, width=25)
+        search_entry.pack(side="left", pady=5)
+        search_entry.bind("<Escape>", lambda event: self.search_var.set(""))
+        self.search_result_label = tk.Label(get_data_frame, text="", anchor="w", width=12)
+        self.search_result_label.pack(side="left", padx=(10,0), pady=5)
+
         # Get data button
         self.get_data_button = tk.Button(get_data_frame, text="Get Data", command=self.get_data, state="disabled")
         self.get_data_button.pack(side="right", padx=(10,0), pady=5)
+        self.sync_all_button = tk.Button(get_data_frame, text="Sync All Days", command=self.sync_all_days, state="disabled")
+        self.sync_all_button.pack(side="right", padx=(10,0), pady=5)
+        self.force_refresh = tk.BooleanVar(value=False)
+        force_refresh_check = tk.Checkbutton(get_data_frame, text="Force refresh", variable=self.force_refresh)
+        force_refresh_check.pack(side="right", padx=(10,0), pady=5)
 
         # Table
         self.table_frame = tk.Frame(self, height=400, relief="solid", bd=1)
         self.table_frame.grid(row=2, column=0, columnspan=2, padx=10, pady=5, sticky="nsew")
-        self.df_table = pdt.Table(self.table_frame, dataframe=pd.DataFrame(), editable=False)
-        self.df_table.show()
+        self.table_placeholder = tk.Label(self.table_frame, text="Loading...")
+        self.table_placeholder.pack(expand=True)
+
+        # Map preview
+        map_frame = tk.LabelFrame(self, text="Map")
+        map_frame.grid(row=0, column=2, rowspan=3, padx=10, pady=5, sticky="nsew")
+        self.map_image = None
+        self.map_preview = tk.Label(map_frame, text="No map", width=35)
+        self.map_preview.pack(padx=5, pady=5, fill="both", expand=True)
 
         # Action buttons
         action_frame = tk.Frame(self)
-        action_frame.grid(row=3, column=0, columnspan=2, padx=10, pady=5, sticky="nsew")
-        self.button_send = tk.Button(action_frame, text="Send WhatsApp", width=15, state="disabled")
+        action_frame.grid(row=3, column=0, columnspan=3, padx=10, pady=5, sticky="nsew")
+        self.button_send = tk.Button(action_frame, text="Send WhatsApp", width=15, state="disabled", command=self.send_whatsapp)
         self.button_send.pack(side="right", padx=(10,0), pady=5)
         self.button_map = tk.Button(action_frame, text="Gen Map PDF", width=15, state="disabled", command=self.generate_map)
         self.button_map.pack(side="right", padx=(10,0), pady=5)
+        self.button_all_maps = tk.Button(action_frame, text="Export All Maps", width=15, state="disabled", command=self.export_all_maps)
+        self.button_all_maps.pack(side="right", padx=(10,0), pady=5)
         self.button_label = tk.Button(action_frame, text="Gen Labels PDF", width=15, state="disabled", command=self.generate_labels)
         self.button_label.pack(side="right", padx=(10,0), pady=5)
+        self.tables_label = tk.Label(action_frame, text="", anchor="w", cursor="hand2")
+        self.tables_label.pack(side="left", pady=5)
+        self.tables_label.bind("<Button-1>", lambda event: self.show_table_issues())
+
+        # Background tasks status bar
+        status_frame = tk.Frame(self)
+        status_frame.grid(row=4, column=0, columnspan=3, padx=10, pady=(0,5), sticky="nsew")
+        self.task_label = tk.Label(status_frame, text="", anchor="w")
+        self.task_label.pack(side="left", padx=(0,10))
+        self.cancel_button = tk.Button(status_frame, text="Cancel", state="disabled", command=self.task_runner.cancel_all)
+        self.cancel_button.pack(side="right", padx=(10,0))
+        self.task_progress = ttk.Progressbar(status_frame, mode="determinate", length=200)
+        self.task_progress.pack(side="right")
 
     def on_combobox_selected(self, event):
-        if self.google_connection.get_state() and self.day_combobox.get():
-            self.get_data_button.config(state="normal")
-        self.my_clear_table(self.df_table)
+        google_state, _ = self.google_connection.get_last_state()
+        if google_state and self.df_table is not None and self.day_combobox.get():
+            self.task_runner.set_state(self.get_data_button, "normal")
+        df = self.day_data.get(self.day_combobox.get())
+        if df is not None:
+            self.show_data(df)
+        else:
+            self.my_clear_table(self.df_table)
+            self.table_assignments = None
+            self.tables_label.config(text="")
+        self.load_map_preview(self.day_combobox.get())
 
     def generate_labels(self):
         """
@@ -140,11 +216,31 @@ class App(tk.Tk):
         if df.empty or not day:
             messagebox.showwarning("Missing data", "Failed to generate labels because no data or day selected.")
             return
-        utils.generate_table_labels_pdf(df, day, "out")
+        import utils
+
+        if self.settings.get_bool("labels", "incremental"):
+            def on_done(changed):
+                messagebox.showinfo(
+                    "Labels", f"{changed} new or changed labels, written to out/{day}-delta.pdf."
+                    if changed else "No new or changed labels.")
+
+            cache_dir = os.path.join(self.settings.get_str("cache", "dir", "cache"), "labels")
+            self.run_task("labels", utils.generate_table_labels_pdf_incremental,
+                          df.copy(), day, "out", cache_dir, assignments=self.assignments_for(day, df),
+                          on_done=on_done, lock_widgets=[self.button_label])
+            return
+        self.run_task("labels", utils.generate_table_labels_pdf, df.copy(), day, "out",
+                      workers=self.settings.get_int("labels", "workers", 1),
+                      chunk_size=self.settings.get_int("labels", "chunk_size", 1000),
+                      assignments=self.assignments_for(day, df),
+                      lock_widgets=[self.button_label])
 
     def generate_map(self):
         """
-        Generate the map pdf with the locations of the reservations.
+        Generate the map pdf with the locations of the reservations, with the
+        booked tables highlighted. The map is drawn locally from the cached
+        cells of the sheet, or exported by Google if the "renderer" setting
+        of the map is "google".
         Needs the Google API credentials to work.
 
         Returns:
@@ -154,8 +250,227 @@ class App(tk.Tk):
         if not day:
             messagebox.showwarning("Missing Data", "Failed to generate map because no day selected.")
             return
-        utils.google_generate_pdf_map(self.google_connection.get_credentials(), self.settings.get("sheets").get("file_id"), self.settings.get("day-" + day).get("sheet_id"), "out", day + "-map")
-    
+        file_id = self.settings.file_id
+        day_settings = self.settings.day(day)
+        force = self.force_refresh.get()
+        dpi = self.settings.get_int("map", "dpi", 200)
+        preview_size = self.settings.get_int("map", "preview_size", 250)
+        renderer = self.settings.get_str("map", "renderer", "local")
+        cache_dir = os.path.join(self.settings.get_str("cache", "dir", "cache"), "maps")
+        df = self.day_data.get(day)
+        assignments = self.assignments_for(day, df)
+
+        def export(progress):
+            import map_renderer
+            import utils
+            from tables import TableAssignments
+            map_range = day_settings.get("map_range") or utils.DEFAULT_MAP_RANGE
+            if renderer == "google":
+                pdf_file_path = utils.google_generate_pdf_map(
+                    self.google_connection, file_id, day_settings.get("sheet_id"), "out", day + "-map",
+                    force=force, progress=progress, map_range=map_range)
+            else:
+                occupied = (assignments or TableAssignments(df)).occupancy if df is not None else {}
+                pdf_file_path = map_renderer.generate_local_maps(
+                    self.google_connection, file_id,
+                    {day: (day_settings.get("sheet_name"), map_range, occupied)},
+                    "out", cache_dir, force=force, progress=progress)[day]
+            return utils.rasterize_pdf_map(pdf_file_path, dpi=dpi, preview_size=preview_size)
+
+        def on_done(paths):
+            if self.day_combobox.get() == day:
+                self.show_map_preview(paths[1])
+
+        self.run_task("map", export, on_done=on_done, lock_widgets=[self.button_map])
+
+    def export_all_maps(self):
+        """
+        Export the maps of all the configured days, then show a summary of
+        timings and failures. The maps are drawn locally with a single
+        download of the cells not cached yet, or exported concurrently by
+        Google if the "renderer" setting of the map is "google".
+        Needs the Google API credentials to work.
+
+        Returns:
+            None
+        """
+        file_id = self.settings.file_id
+        sheet_ids = dict()
+        for day in self.day_combobox.cget("values"):
+            day_settings = self.settings.day(day)
+            if not day_settings:
+                messagebox.showwarning("Day Not Configured", f"Day {day} not configured.")
+                return
+            sheet_ids[day] = day_settings.get("sheet_id")
+        import utils
+        map_ranges = {day: self.settings.day(day).get("map_range") or utils.DEFAULT_MAP_RANGE for day in sheet_ids}
+
+        if self.settings.get_str("map", "renderer", "local") != "google":
+            self.render_all_maps(file_id, map_ranges)
+            return
+
+        self.run_task("all_maps", utils.google_export_all_maps, self.google_connection,
+                      file_id, sheet_ids, "out",
+                      max_workers=self.settings.get_int("map", "max_concurrent_exports", 3),
+                      force=self.force_refresh.get(), map_ranges=map_ranges,
+                      on_done=self.show_maps_summary, lock_widgets=[self.button_all_maps, self.button_map])
+
+    def show_maps_summary(self, results):
+        """
+        Show the timings and failures of the maps exported, as returned by
+        `utils.google_export_all_maps`.
+        """
+        lines = [f"{result['day']}: " + (f"failed ({result['error']})" if result["error"] else "ok")
+                 + f" in {result['seconds']:.1f}s" for result in results]
+        failed = sum(1 for result in results if result["error"])
+        show = messagebox.showwarning if failed else messagebox.showinfo
+        show("Export All Maps", f"{len(results) - failed}/{len(results)} maps exported.\n\n" + "\n".join(lines))
+        self.load_map_preview(self.day_combobox.get())
+
+    def render_all_maps(self, file_id, map_ranges):
+        """
+        Draw the maps of all the configured days locally, with the booked
+        tables of the downloaded days highlighted, then show a summary of
+        timings and failures. A day that fails does not stop the others.
+
+        Args:
+            file_id (str): The ID of the Google Sheet file.
+            map_ranges (dict): Map from the day to the range of its map.
+        """
+        cache_dir = os.path.join(self.settings.get_str("cache", "dir", "cache"), "maps")
+        sheet_names = {day: self.settings.day(day).get("sheet_name") for day in map_ranges}
+        day_data = dict(self.day_data)
+        assignments = {day: self.assignments_for(day, df) for day, df in day_data.items()}
+        force = self.force_refresh.get()
+
+        def render(progress):
+            import map_renderer
+            from tables import TableAssignments
+            # Only the days never shown are parsed here.
+            for day, df in day_data.items():
+                if assignments[day] is None:
+                    assignments[day] = TableAssignments(df)
+            maps = {day: (sheet_names[day], map_range,
+                          assignments[day].occupancy if day in assignments else {})
+                    for day, map_range in map_ranges.items()}
+            return map_renderer.export_all_local_maps(
+                self.google_connection, file_id, maps, "out", cache_dir, force=force, progress=progress)
+
+        self.run_task("all_maps", render, on_done=self.show_maps_summary,
+                      lock_widgets=[self.button_all_maps, self.button_map])
+
+    def load_map_preview(self, day):
+        """
+        Show the preview of the map of a day, if it was already generated.
+        The preview is (re)rendered in the background only if the map changed.
+
+        Args:
+            day (str): The selected day.
+        """
+        pdf_file_path = os.path.join("out", day + "-map.pdf")
+        if not os.path.exists(pdf_file_path):
+            self.show_map_preview(None)
+            return
+        dpi = self.settings.get_int("map", "dpi", 200)
+        preview_size = self.settings.get_int("map", "preview_size", 250)
+
+        def rasterize(progress):
+            import utils
+            return utils.rasterize_pdf_map(pdf_file_path, dpi=dpi, preview_size=preview_size)
+
+        def on_done(paths):
+            if self.day_combobox.get() == day:
+                self.show_map_preview(paths[1])
+
+        # One task per day: a preview still running for another day must not
+        # drop the request of the day just selected.
+        self.run_task("preview " + day, rasterize, on_done=on_done)
+
+    def show_map_preview(self, preview_file_path):
+        """
+        Show an image in the map preview, or a placeholder if None.
+        """
+        if preview_file_path is None:
+            self.map_image = None
+            self.map_preview.config(image="", text="No map")
+            return
+        self.map_image = tk.PhotoImage(file=preview_file_path)
+        self.map_preview.config(image=self.map_image, text="")
+
+    def send_whatsapp(self):
+        """
+        Send the WhatsApp message in the settings once to every valid phone
+        number in the table, and write the result of each send in the "Invio"
+        column. The invalid numbers are not sent to and marked as such.
+        Needs the WhatsApp API credentials to work.
+
+        Returns:
+            None
+        """
+        df = self.df_table.model.df
+        day = self.day_combobox.get()
+        if df.empty or not day:
+            messagebox.showwarning("Missing data", "Failed to send messages because no data or day selected.")
+            return
+        # Only the last known state here, the connection is checked again by the task.
+        whatsapp_state, _ = self.whatsapp_connection.get_last_state()
+        if not whatsapp_state:
+            messagebox.showwarning("WhatsApp", "WhatsApp is not connected.")
+            return
+
+        import phones
+        import whatsapp
+        from outbox import SENT
+
+        message = self.settings.get_str("Other", "message")
+        # One message for each distinct valid number, in E.164 format.
+        valid_phones, invalid = phones.unique_valid_phones(df)
+        # Messages already sent for this day (e.g. by an interrupted run) are skipped.
+        pending = self.outbox.enqueue(day, valid_phones, message)
+        already_sent = len(valid_phones) - len(set(pending))
+        question = f"Send the message to {len(pending)} phone numbers?"
+        if already_sent:
+            question += f"\n{already_sent} phone numbers already received it and will be skipped."
+        if invalid:
+            question += f"\n{invalid} reservations have an invalid phone number and will be skipped."
+        if not pending:
+            messagebox.showinfo("Send WhatsApp", "All the phone numbers already received the message.")
+        elif not messagebox.askyesno("Send WhatsApp", question):
+            return
+
+        def write_statuses():
+            # Write the status of each phone, as recorded in the outbox.
+            statuses = self.outbox.statuses(day, message)
+            normalized = phones.normalize_phones(df["Telefono"])
+            sent = normalized["phone"].map(statuses).astype(object) \
+                .where(normalized["valid"] | df["Telefono"].isna(), "invalid")
+            if self.df_table.model.df is df:
+                # Only the column changes: no need to index and parse the rows again.
+                self.df_table.set_column("Invio", sent)
+            else:
+                df["Invio"] = sent
+
+        def on_done(results):
+            failed = sum(1 for result in results if result["status"] != SENT)
+            messagebox.showinfo("Send WhatsApp", f"Sent {len(results) - failed}/{len(results)} messages.")
+
+        if not pending:
+            write_statuses()
+            return
+        rate = self.settings.get_float("whatsapp", "rate", 20)
+        max_workers = self.settings.get_int("whatsapp", "max_workers", 8)
+
+        def send(progress):
+            # The status check may need a request to the Graph API, so it is
+            # done here and not on the Tk thread.
+            if not self.whatsapp_connection.get_state():
+                raise Exception(f"WhatsApp is not connected: {self.whatsapp_connection.get_last_state()[1]}")
+            return whatsapp.send_bulk_messages(
+                self.whatsapp_connection, pending, message, rate=rate, max_workers=max_workers,
+                on_result=lambda result: self.outbox.record(day, message, result), progress=progress)
+
+        self.run_task("send", send, on_done=on_done, on_finally=write_statuses, lock_widgets=[self.button_send])
+
     def get_data(self):
         """
         Download the data from the Google Sheets, save it in a dataframe and
@@ -172,45 +487,266 @@ class App(tk.Tk):
             messagebox.showwarning("No Day Selected", "Please select a day.")
             return
 
-        # Show loading message box
-        loading_message = tk.Toplevel(self)
-        loading_message.title("Loading")
-        tk.Label(loading_message, text="Loading data, please wait...").pack(padx=20, pady=20)
-        loading_message.update()
+        # Get data from Google Sheets
+        file_id = self.settings.file_id
+        day_settings = self.settings.day(day)
+        if not day_settings:
+            messagebox.showwarning("Day Not Configured", "Day not configured.")
+            return
+        print(day_settings)
+        force_refresh = self.force_refresh.get()
+
+        def download(progress):
+            import utils
+            progress(0, 1, f"Downloading {day}...")
+            df = utils.google_download_worksheet(
+                self.google_connection, file_id, day_settings.get("sheet_name"),
+                cache=self.worksheet_cache, force_refresh=force_refresh)
+            self.store.save_day(day, df)
+            return df
+
+        def on_done(df):
+            self.day_data[day] = df
+            if self.day_combobox.get() == day:
+                self.show_data(df)
+
+        self.run_task("data", download, on_done=on_done,
+                      lock_widgets=[self.get_data_button, self.day_combobox])
+
+    def sync_all_days(self):
+        """
+        Download the data of all the configured days with a single request,
+        so that switching between days does not need any other download.
+        Needs the Google API credentials to work.
 
-        try:
-            # Get data from Google Sheets
-            file_id = self.settings.get("sheets").get("file_id")
-            day_settings = self.settings.get("day-" + day)
+        Returns:
+            None
+        """
+        file_id = self.settings.file_id
+        sheet_names = dict()
+        for day in self.day_combobox.cget("values"):
+            day_settings = self.settings.day(day)
             if not day_settings:
-                messagebox.showwarning("Day Not Configured", "Day not configured.")
+                messagebox.showwarning("Day Not Configured", f"Day {day} not configured.")
                 return
-            print(day_settings)
-
-            df = utils.google_download_worksheet(self.google_connection.get_credentials(), file_id, day_settings.get("sheet_name"))
-
-            if not df.empty:
-                print(df)
-                self.df_table.model.df = df
-                self.df_table.show()
-                self.df_table.redraw()
-                self.button_send.config(state="normal")
-                self.button_map.config(state="normal")
-                self.button_label.config(state="normal")
-        finally:
-            self.update_idletasks()
-            # Close loading message box
-            loading_message.destroy()
-        return
-
-    def load_settings(self) -> dict:
-        config = configparser.ConfigParser()
-        config.read('settings.ini')
-        settings = dict()
-        for section in config.sections():
-            items=config.items(section)
-            settings[section]=dict(items)
-        return settings
+            sheet_names[day] = day_settings.get("sheet_name")
+        force_refresh = self.force_refresh.get()
+
+        def download(progress):
+            import utils
+            progress(0, 1, f"Downloading {len(sheet_names)} days...")
+            dfs = utils.google_download_worksheets(
+                self.google_connection, file_id, sheet_names,
+                cache=self.worksheet_cache, force_refresh=force_refresh)
+            for day, df in dfs.items():
+                self.store.save_day(day, df)
+            return dfs
+
+        def on_done(dfs):
+            self.day_data.update(dfs)
+            df = self.day_data.get(self.day_combobox.get())
+            if df is not None:
+                self.show_data(df)
+
+        self.run_task("data", download, on_done=on_done,
+                      lock_widgets=[self.sync_all_button, self.get_data_button])
+
+    def load_modules(self, progress):
+        """
+        Import the deferred modules. Run in the background at startup.
+        """
+        for done, name in enumerate(DEFERRED_MODULES):
+            progress(done, len(DEFERRED_MODULES), f"Loading {name}...")
+            importlib.import_module(name)
+
+    def finish_startup(self):
+        """
+        Create the widgets and objects that need the deferred modules, then
+        load the saved data.
+        """
+        from table_view import TableView
+
+        self.create_worksheet_cache()
+        self.create_store()
+
+        self.table_placeholder.destroy()
+        self.df_table = TableView(self.table_frame)
+        self.df_table.pack(fill="both", expand=True)
+
+        self.load_snapshots()
+        # Show the data downloaded while the modules were loading, if any.
+        df = self.day_data.get(self.day_combobox.get())
+        if df is not None:
+            self.show_data(df)
+        self.update_buttons()
+
+        self.startup_times["ready"] = time.perf_counter() - STARTUP_TIME
+        self.report_startup()
+
+    def create_worksheet_cache(self):
+        from worksheet_cache import WorksheetCache
+        self.worksheet_cache = WorksheetCache(
+            cache_dir=self.settings.get_str("cache", "dir", "cache"),
+            max_age_days=self.settings.get_float("cache", "max_age_days", 7),
+            max_size_mb=self.settings.get_float("cache", "max_size_mb", 100))
+
+    def create_store(self):
+        from outbox import Outbox
+        from store import ReservationStore
+        path = self.settings.get_str("store", "path", "reservations.db")
+        self.store = ReservationStore(path)
+        self.outbox = Outbox(path)
+
+    def report_first_paint(self):
+        self.update_idletasks()
+        self.startup_times["first_paint"] = time.perf_counter() - STARTUP_TIME
+        self.report_startup()
+
+    def report_startup(self):
+        """
+        Print the startup times collected so far, in milliseconds.
+        """
+        print("Startup times: " + ", ".join(
+            f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.startup_times.items()))
+
+    def load_snapshots(self):
+        """
+        Load the data of the configured days saved in the local store, and
+        show the most recently saved one. Works without network.
+
+        Returns:
+            None
+        """
+        days = self.day_combobox.cget("values")
+        for day in days:
+            df = self.store.load_day(day)
+            if df is not None:
+                self.day_data[day] = df
+        saved_days = [day for day in self.store.days() if day in self.day_data]
+        if saved_days:
+            self.day_combobox.set(saved_days[0])
+            self.show_data(self.day_data[saved_days[0]])
+            self.load_map_preview(saved_days[0])
+
+    def show_data(self, df):
+        """
+        Show the downloaded data in the table and enable the actions on it.
+
+        Args:
+            df (pd.DataFrame): The data to show.
+        """
+        if self.df_table is None:
+            # Shown by finish_startup() once the table is created.
+            return
+        if not df.empty:
+            print(df)
+        # The rows are always replaced, even with no reservations, so that the
+        # actions never use the rows of the previously selected day.
+        # Only the visible rows are drawn
+        self.df_table.set_dataframe(df)
+        from search import SearchIndex
+        self.search_indexes.setdefault(self.day_combobox.get(), SearchIndex()).update(df)
+        self.on_search()
+        self.check_tables(df)
+        state = "disabled" if df.empty else "normal"
+        self.task_runner.set_state(self.button_send, state)
+        self.task_runner.set_state(self.button_map, state)
+        self.task_runner.set_state(self.button_label, state)
+
+    def check_tables(self, df):
+        """
+        Parse the tables of the shown data and show the double bookings and
+        the "Num tavoli" mismatches found, if any.
+        """
+        from tables import TableAssignments
+        self.table_assignments = TableAssignments(df)
+        self.day_assignments[self.day_combobox.get()] = (df, self.table_assignments)
+        self.tables_label.config(text=self.table_assignments.summary(),
+                                 fg="red" if self.table_assignments.has_issues() else "black")
+
+    def assignments_for(self, day, df):
+        """
+        Return the tables of `df` parsed by check_tables(), or None if that
+        data of the day was never shown.
+        """
+        shown_df, assignments = self.day_assignments.get(day, (None, None))
+        return assignments if df is not None and shown_df is df else None
+
+    def show_table_issues(self):
+        if self.table_assignments is None or not self.table_assignments.has_issues():
+            return
+        names = self.df_table.model.df["Nome"]
+        messagebox.showwarning("Tables", self.table_assignments.report(names))
+
+    def on_search(self):
+        """
+        Show only the rows of the selected day matching the search box, by
+        name, phone number or table ID.
+        """
+        if self.df_table is None:
+            return
+        query = self.search_var.get()
+        index = self.search_indexes.get(self.day_combobox.get())
+        if not query.strip() or index is None:
+            self.df_table.set_filter(None)
+            self.search_result_label.config(text="")
+            return
+        labels = index.search(query)
+        self.df_table.set_filter(labels)
+        self.search_result_label.config(text=f"{len(labels)} found")
+
+    def run_task(self, name, fn, *args, on_done=None, on_finally=None, lock_widgets=(), cancellable=True,
+                 **kwargs):
+        """
+        Run `fn(*args, progress=..., **kwargs)` in the background, showing its
+        progress in the status bar.
+
+        Args:
+            name (str): Name of the action, only one per name can run.
+            fn (callable): The function to run.
+            on_done (callable): Called with the result on the Tk thread.
+            on_finally (callable): Called on the Tk thread when the task
+                completes, even if it failed or was cancelled.
+            lock_widgets (list): Widgets disabled while the task runs.
+            cancellable (bool): If False, the Cancel button does not stop it.
+        """
+        def work(task):
+            return fn(*args, progress=task.progress, **kwargs)
+
+        def on_error(e):
+            messagebox.showerror("Error", f"{name} failed: {str(e)}")
+
+        def finish():
+            if on_finally:
+                on_finally()
+            if not self.task_runner.tasks:
+                self.task_label.config(text="")
+                self.task_progress.config(value=0)
+            if not self.task_runner.has_cancellable():
+                self.cancel_button.config(state="disabled")
+
+        task = self.task_runner.submit(
+            name, work, on_done=on_done, on_error=on_error,
+            on_progress=self.show_progress, on_finally=finish,
+            lock_widgets=lock_widgets, cancellable=cancellable)
+        if task is None:
+            # Only the actions started from a button, the background checks
+            # and previews are just skipped.
+            if lock_widgets:
+                messagebox.showinfo("Busy", f"{name} is already running.")
+        else:
+            self.task_label.config(text=f"Running {name}...")
+            if cancellable:
+                self.cancel_button.config(state="normal")
+
+    def show_progress(self, done, total, text):
+        self.task_progress.config(maximum=max(total, 1), value=done)
+        self.task_label.config(text=text)
+
+    def on_close(self):
+        self.task_runner.shutdown()
+        self.google_connection.credentials.stop()
+        self.destroy()
 
     def open_settings_window(self):
         settings_window = tk.Toplevel(self)
@@ -248,21 +784,13 @@ class App(tk.Tk):
         save_button.grid(row=row, column=0, columnspan=2, pady=10)
 
     def save_settings(self, settings_window, entries):
-        settings = dict()
-        config = configparser.ConfigParser()
-
+        data = {sect: dict(items) for sect, items in self.settings.items()}
         for sect in entries:
-            config.add_section(sect)
-            settings[sect] = dict()
             for key in entries[sect]:
-                val = entries[sect][key].get()
-                config.set(sect,key,val)
-                settings[sect] = val
-        self.settings = settings
-        print(config)
-        # Save settings to settings.ini
-        with open('settings.ini', 'w') as configfile:
-            config.write(configfile)
+                data[sect][key] = entries[sect][key].get()
+
+        # Save settings to settings.ini, the subscribers get the changed keys
+        self.settings.save(data)
 
         # Close settings window
         settings_window.destroy()
@@ -277,79 +805,142 @@ class App(tk.Tk):
             messagebox.showerror("Secrets File Not Found", "Please create a secrets.json file.")
             return {}
 
-    def load_config(self):
-        try:
-            with open('config.json', 'r') as f:
-                config = json.load(f)
-                return config
-        except FileNotFoundError:
-            messagebox.showwarning("Config File Not Found", "Please configure the app.")
-            return {}
-
-    def save_config(self, config):
-        try:
-            with open('config.json', 'w') as f:
-                json.dump(config, f, indent=4)
-                messagebox.showinfo("Config Saved", "Configuration saved successfully.")
-        except Exception as e:
-            messagebox.showerror("Error Saving Config", f"Error: {str(e)}")
-
     def configure_options(self):
-        if not self.configurator:
-            self.configurator = AppConfigurator(self, self.config)
+        if not self.configurator or not self.configurator.winfo_exists():
+            self.configurator = AppConfigurator(self, self.settings)
         else:
             self.configurator.deiconify()
 
-    def submit_selection(self):
-        self.day_selection.update_config()
-        self.save_config(self.config)
-        selected_days = self.day_selection.get_selected_days()
-        if selected_days:
-            messagebox.showinfo("Selected Days", f"Selected days: {', '.join(selected_days)}")
+    def on_settings_changed(self, changed):
+        """
+        Reset only the caches and connections affected by the changed settings.
+
+        Args:
+            changed (set): The (section, key) tuples that changed.
+        """
+        keys = {f"{sect}.{key}" for sect, key in changed}
+        print("Settings changed: " + ", ".join(sorted(keys)))
+
+        if "sheets.file_id" in keys:
+            # Another spreadsheet: nothing downloaded so far is valid.
+            import utils
+            self.day_data.clear()
+            self.search_indexes.clear()
+            self.day_assignments.clear()
+            utils._header_cache.clear()
+            if self.worksheet_cache:
+                self.worksheet_cache.clear()
         else:
-            messagebox.showwarning("No Selection", "Please select at least one day.")
+            for sect, key in changed:
+                if sect.startswith("day-") and key in ("sheet_name", "sheet_id"):
+                    self.day_data.pop(sect[len("day-"):], None)
+                    self.day_assignments.pop(sect[len("day-"):], None)
+
+        if keys & {"API.google_cred_file", "API.google_token_file"}:
+            self.google_connection.set_creds_file(self.settings.get_str("API", "google_cred_file"))
+            self.google_connection.set_token_file(self.settings.get_str("API", "google_token_file"))
+            self.google_connection.invalidate()
+        if "API.whatsapp_token_file" in keys:
+            self.whatsapp_connection.set_token_file(self.settings.get_str("API", "whatsapp_token_file"))
+            self.whatsapp_connection.invalidate()
+        if "API.status_ttl" in keys:
+            status_ttl = self.settings.get_int("API", "status_ttl", 60)
+            self.google_connection.set_status_ttl(status_ttl)
+            self.whatsapp_connection.set_status_ttl(status_ttl)
+
+        # Created by finish_startup(), recreated only if already there.
+        if self.worksheet_cache and any(sect == "cache" for sect, _ in changed):
+            self.create_worksheet_cache()
+        if self.store and "store.path" in keys:
+            self.create_store()
+
+        if "sheets.days" in keys:
+            self.day_combobox.config(values=self.settings.days)
+        if "Other.message" in keys:
+            self.test_label.config(text=self.settings.get_str("Other", "message"))
+        if "map.renderer" in keys:
+            self.update_buttons()
 
     def update_status_widgets(self):
-
+        """
+        Show the last known state of the connections. Does not log in.
+        """
         for conn, status_label, info_label in [
                 (self.google_connection, self.google_status, self.google_info),
                 (self.whatsapp_connection, self.whatsapp_status, self.whatsapp_info)]:
 
-            state = conn.get_state()
-            message = conn.get_message()
+            state, message = conn.get_last_state()
+            if conn.last_check is None:
+                status_label.config(text="●", fg="black")
+                info_label.config(text="Checking...")
+                continue
 
             status_label.config(text="●", fg=("red" if not state else "green"))
             info_label.config(text=message)
 
+    def check_connections(self):
+        """
+        Refresh the state of the connections in the background, then update
+        the widgets depending on it.
+        """
+        def check(progress):
+            progress(0, 2, "Checking Google connection...")
+            self.google_connection.refresh()
+            progress(1, 2, "Checking WhatsApp connection...")
+            self.whatsapp_connection.refresh()
+
+        def on_finally():
+            self.update_status_widgets()
+            self.update_buttons()
+
+        self.run_task("connections", check, on_finally=on_finally, cancellable=False)
+
+    def update_buttons(self):
+        """
+        Enable the buttons according to the last known Google state and to
+        the data in the table.
+        """
+        # Nothing can be done before finish_startup() created the table.
+        ready = self.df_table is not None
+        google_state, _ = self.google_connection.get_last_state()
+        has_data = ready and not self.df_table.model.df.empty
+        for button in [self.get_data_button, self.sync_all_button]:
+            self.task_runner.set_state(button, "normal" if ready and google_state else "disabled")
+        # The local renderer can draw the maps offline from the cached cells.
+        local_maps = self.settings.get_str("map", "renderer", "local") != "google"
+        for button in [self.button_map, self.button_all_maps]:
+            self.task_runner.set_state(button, "normal" if ready and (google_state or local_maps) else "disabled")
+        self.task_runner.set_state(self.button_send, "normal" if has_data and google_state else "disabled")
+        # Labels are generated from the local data, no connection needed.
+        self.task_runner.set_state(self.button_label, "normal" if has_data else "disabled")
+
     def update_ui(self):
-        self.settings = self.load_settings()
+        # Parses the file again only if it was modified
+        self.settings.reload()
         self.update_status_widgets()
-        google_state = self.google_connection.get_state()
-        for button in [self.button_send, self.button_map, self.button_label, self.get_data_button]:
-            button.config(state="disabled" if not google_state else "normal")
+        self.update_buttons()
+        self.check_connections()
 
-        self.test_label.config(text=self.settings.get("message"))
-        self.day_combobox.config(values=self.settings.get("sheets").get("days").split(", "))
+        self.test_label.config(text=self.settings.get_str("Other", "message"))
+        self.day_combobox.config(values=self.settings.days)
 
     def google_connect(self):
         self.google_connection.connect(
-            self.settings.get("API").get("google_cred_file"),
-            self.settings.get("API").get("google_token_file"))
+            self.settings.get_str("API", "google_cred_file"),
+            self.settings.get_str("API", "google_token_file"))
         self.update_status_widgets()
-        google_state = self.google_connection.get_state()
-        for button in [self.button_send, self.button_map, self.button_label, self.get_data_button]:
-            button.config(state="disabled" if not google_state else "normal")
+        self.update_buttons()
 
     def whatsapp_connect(self):
         self.whatsapp_connection.connect(
-            self.settings.get("API").get("whatsapp_token_file"),
+            self.settings.get_str("API", "whatsapp_token_file"),
             "iliad")
         self.update_status_widgets()
 
-    def my_clear_table(self, table: pdt.Table):
-        if table.model.df.empty:
+    def my_clear_table(self, table):
+        if table is None or table.model.df.empty:
             return
-        table.clearTable()
+        table.clear()
 
 if __name__ == "__main__":
     app = App()
@@ -1,12 +1,22 @@
 import tkinter as ttk
 
+# Properties of each day, saved in its [day-<key>] section of settings.ini.
+DAY_FIELDS = [("sheet_name", "Sheet Name:"), ("sheet_id", "Sheet ID:"), ("day_string", "Day String:"),
+              ("map_range", "Map Range:")]
+
+
 class AppConfigurator(ttk.Toplevel):
-    def __init__(self, parent, config):
+    """
+    Edit the spreadsheet and the days of the settings: the [sheets] section
+    and one [day-<key>] section for each day.
+    """
+    def __init__(self, parent, settings):
         super().__init__(parent)
         self.title("Configuration")
         self.geometry("400x500")
 
-        self.config = config
+        self.settings = settings
+        self.day_entries = {}
 
         self.create_widgets()
 
@@ -19,52 +29,53 @@ class AppConfigurator(ttk.Toplevel):
         self.file_id_label = ttk.Label(self.google_frame, text="File ID:")
         self.file_id_label.pack()
         self.file_id_entry = ttk.Entry(self.google_frame, width=60)
-        self.file_id_entry.insert(0, self.config.get('file_id', ''))
+        self.file_id_entry.insert(0, self.settings.file_id or '')
         self.file_id_entry.pack()
 
-        for day in self.config.get('days', []):
-            self.create_day_widgets(self.google_frame, day)
-
-        self.new_day_button = ttk.Button(self.google_frame, text="Add Day", command=self.add_day)
-
         # Set days (sheets)
+        for day in self.settings.days:
+            self.create_day_widgets(self.google_frame, day)
 
-        # Add days (sheets): when the user clicks this button, a new label will appaer with an entry box, one for each property: key, sheet name, day string, sheet id
+        # Add days (sheets): a new frame with an entry box for each property
+        self.new_day_frame = ttk.Frame(self)
+        self.new_day_frame.pack()
+        self.new_day_key = ttk.Entry(self.new_day_frame, width=20)
+        self.new_day_key.pack(side='left')
+        self.new_day_button = ttk.Button(self.new_day_frame, text="Add Day", command=self.add_day)
+        self.new_day_button.pack(side='left')
 
         # Save button
         self.button = ttk.Button(self, text="Save", command=self.save)
         self.button.pack()
 
+    def add_day(self):
+        day = self.new_day_key.get().strip()
+        if not day or day in self.day_entries:
+            return
+        self.create_day_widgets(self.google_frame, day)
+        self.new_day_key.delete(0, 'end')
+
     def save(self):
-        self.config['file_id'] = self.file_id_entry.get()
-        self.master.save_config(self.config)
+        data = {sect: dict(items) for sect, items in self.settings.items()}
+        sheets = data.setdefault('sheets', {})
+        sheets['file_id'] = self.file_id_entry.get()
+        sheets['days'] = ", ".join(self.day_entries)
+        for day, entries in self.day_entries.items():
+            day_section = data.setdefault('day-' + day, {})
+            for key, entry in entries.items():
+                day_section[key] = entry.get()
+        self.settings.save(data)
         self.withdraw()
 
     def create_day_widgets(self, parent, day):
-        day_config = self.config.get("days", []).get(day, {})
+        day_config = self.settings.day(day)
         day_frame = ttk.LabelFrame(parent, text=day)
         day_frame.pack(fill='y', expand=True)
-        day_sheet_id_label = ttk.Label(day_frame, text="Sheet ID:")
-        day_sheet_id_label.pack()
-        day_sheet_id_entry = ttk.Entry(day_frame, width=60)
-        day_sheet_id_entry.insert(0, (day_config['sheet_id'], ''))
-        day_sheet_id_entry.pack()
-        # self.new_day_button.pack()
-        # self_new_day_key_label = ttk.Label(self.google_frame, text="Key:")
-        # self_new_day_key_label.pack()
-        # self.new_day_key = ttk.Entry(self.google_frame, width=20)
-        # self.new_day_key.pack()
-        # self.new_day_sheet_name_label = ttk.Label(self.google_frame, text="Sheet Name:")
-        # self.new_day_sheet_name_label.pack()
-        # self.new_day_sheet_name = ttk.Entry(self.google_frame, width=20)
-        # self.new_day_sheet_name.pack()
-        # self.new_day_day_string_label = ttk.Label(self.google_frame, text="Day String:")
-        # self.new_day_day_string_label.pack()
-        # self.new_day_day_string = ttk.Entry(self.google_frame, width=20)
-        # self.new_day_day_string.pack()
-        # self.new_day_sheet_id_label = ttk.Label(self.google_frame, text="Sheet ID:")
-        # self.new_day_sheet_id_label.pack()
-        # self.new_day_sheet_id = ttk.Entry(self.google_frame, width=20)
-        # self.new_day_sheet_id.pack()
-        # self.new_day_save_button = ttk.Button(self.google_frame, text="Save", command=self.save_new_day)
-        # self.new_day_save_button.pack()
+        self.day_entries[day] = {}
+        for key, text in DAY_FIELDS:
+            label = ttk.Label(day_frame, text=text)
+            label.pack()
+            entry = ttk.Entry(day_frame, width=60)
+            entry.insert(0, day_config.get(key, ''))
+            entry.pack()
+            self.day_entries[day][key] = entry
@@ -0,0 +1,242 @@
+# cli.py
+#
+# Headless entry point, to run the app operations without a display
+# (e.g. from cron). It does not import tkinter.
+#
+#   python cli.py sync labels map --all
+#   python cli.py send --day gio
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from connection import GoogleConnection, WhatsAppConnection
+from outbox import Outbox, SENT
+from settings import Settings
+from store import ReservationStore
+from tables import TableAssignments
+from worksheet_cache import WorksheetCache
+import map_renderer
+import phones
+import utils
+import whatsapp
+
+STAGES = ["sync", "labels", "map", "send"]
+
+# Exit codes.
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_NOT_CONNECTED = 3
+
+
+class Pipeline:
+    """
+    Run the requested stages, in the order of STAGES, for each day.
+
+    The "sync" stage downloads all the days with a single request, then the
+    other stages of each day run in parallel. If a stage of a day fails, the
+    following stages of that day are skipped.
+    """
+    def __init__(self, settings, stages, days, output_dir="out", force=False, jobs=4):
+        self.settings = settings
+        self.stages = [stage for stage in STAGES if stage in stages]
+        self.days = days
+        self.output_dir = output_dir
+        self.force = force
+        self.jobs = jobs
+
+        self.google_connection = GoogleConnection(
+            creds_file=settings.get_str("API", "google_cred_file"),
+            token_file=settings.get_str("API", "google_token_file"))
+        self.whatsapp_connection = WhatsAppConnection(
+            token_file=settings.get_str("API", "whatsapp_token_file"),
+            phone_number_key="iliad")
+        store_path = settings.get_str("store", "path", "reservations.db")
+        self.store = ReservationStore(store_path)
+        self.outbox = Outbox(store_path)
+        self.worksheet_cache = WorksheetCache(
+            cache_dir=settings.get_str("cache", "dir", "cache"),
+            max_age_days=settings.get_float("cache", "max_age_days", 7),
+            max_size_mb=settings.get_float("cache", "max_size_mb", 100))
+
+        # The days are sent in parallel, but all together within the rate.
+        self.rate_limiter = whatsapp.RateLimiter(
+            settings.get_float("whatsapp", "rate", 20), burst=settings.get_int("whatsapp", "max_workers", 8))
+
+        # Saved data of each day and its parsed tables, shared by the stages.
+        self.loaded = {}
+
+        # Failed stage of each day, if any.
+        self.failures = {}
+
+    def check_connections(self) -> bool:
+        """
+        Check that the connections needed by the stages are available.
+        """
+        connected = True
+        # The local renderer can draw the maps offline from the cached cells.
+        needs_google = {"sync", "map"} if self.settings.get_str("map", "renderer", "local") == "google" else {"sync"}
+        if needs_google & set(self.stages):
+            if not self.google_connection.get_state():
+                print(f"Google: {self.google_connection.get_message()}", file=sys.stderr)
+                connected = False
+        if "send" in self.stages:
+            if not self.whatsapp_connection.get_state():
+                print(f"WhatsApp: {self.whatsapp_connection.get_message()}", file=sys.stderr)
+                connected = False
+        return connected
+
+    def run(self) -> int:
+        if not self.check_connections():
+            return EXIT_NOT_CONNECTED
+
+        if "sync" in self.stages:
+            start = time.perf_counter()
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"sync failed: {e}", file=sys.stderr)
+                return EXIT_FAILED
+            print(f"sync done in {time.perf_counter() - start:.1f}s.")
+
+        stages = [stage for stage in self.stages if stage != "sync"]
+        if stages:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                list(executor.map(lambda day: self._run_day(day, stages), self.days))
+
+        for day, stage in self.failures.items():
+            print(f"{day}: failed at stage {stage}.", file=sys.stderr)
+        return EXIT_FAILED if self.failures else EXIT_OK
+
+    def _run_day(self, day, stages):
+        for stage in stages:
+            start = time.perf_counter()
+            try:
+                getattr(self, stage)(day)
+            except Exception as e:
+                print(f"{day}: {stage} failed: {e}", file=sys.stderr)
+                self.failures[day] = stage
+                return
+            print(f"{day}: {stage} done in {time.perf_counter() - start:.1f}s.")
+
+    def sync(self):
+        """
+        Download all the days with a single request and save them in the store.
+        """
+        sheet_names = {day: self._day_settings(day).get("sheet_name") for day in self.days}
+        dfs = utils.google_download_worksheets(
+            self.google_connection, self.settings.file_id, sheet_names,
+            cache=self.worksheet_cache, force_refresh=self.force)
+        for day, df in dfs.items():
+            self.store.save_day(day, df)
+
+    def labels(self, day):
+        df = self._load_day(day)
+        assignments = self._load_day_tables(day)[1]
+        if assignments.has_issues():
+            print(f"{day}: {assignments.summary()}\n{assignments.report(df['Nome'])}", file=sys.stderr)
+        if self.settings.get_bool("labels", "incremental"):
+            cache_dir = os.path.join(self.settings.get_str("cache", "dir", "cache"), "labels")
+            utils.generate_table_labels_pdf_incremental(
+                df, day, self.output_dir, cache_dir, assignments=assignments)
+        else:
+            utils.generate_table_labels_pdf(
+                df, day, self.output_dir,
+                workers=self.settings.get_int("labels", "workers", 1),
+                chunk_size=self.settings.get_int("labels", "chunk_size", 1000),
+                assignments=assignments)
+
+    def map(self, day):
+        day_settings = self._day_settings(day)
+        file_id = self.settings.file_id
+        map_range = day_settings.get("map_range") or utils.DEFAULT_MAP_RANGE
+        if self.settings.get_str("map", "renderer", "local") == "google":
+            pdf_file_path = utils.google_generate_pdf_map(
+                self.google_connection, file_id, day_settings.get("sheet_id"), self.output_dir,
+                day + "-map", force=self.force, map_range=map_range)
+        else:
+            # Drawn locally, with the tables booked in the saved data highlighted.
+            _, assignments = self._load_day_tables(day)
+            occupied = assignments.occupancy if assignments is not None else {}
+            cache_dir = os.path.join(self.settings.get_str("cache", "dir", "cache"), "maps")
+            pdf_file_path = map_renderer.generate_local_maps(
+                self.google_connection, file_id, {day: (day_settings.get("sheet_name"), map_range, occupied)},
+                self.output_dir, cache_dir, force=self.force)[day]
+        utils.rasterize_pdf_map(
+            pdf_file_path, dpi=self.settings.get_int("map", "dpi", 200),
+            preview_size=self.settings.get_int("map", "preview_size", 250))
+
+    def send(self, day):
+        df = self._load_day(day)
+        message = self.settings.get_str("Other", "message")
+        valid_phones, invalid = phones.unique_valid_phones(df)
+        if invalid:
+            print(f"{day}: {invalid} reservations with an invalid phone number skipped.", file=sys.stderr)
+        pending = self.outbox.enqueue(day, valid_phones, message)
+        print(f"{day}: sending to {len(pending)} phone numbers.")
+        results = whatsapp.send_bulk_messages(
+            self.whatsapp_connection, pending, message,
+            max_workers=self.settings.get_int("whatsapp", "max_workers", 8),
+            on_result=lambda result: self.outbox.record(day, message, result),
+            rate_limiter=self.rate_limiter)
+        failed = [result["phone"] for result in results if result["status"] != SENT]
+        if failed:
+            raise Exception(f"{len(failed)} messages not sent.")
+
+    def _day_settings(self, day) -> dict:
+        day_settings = self.settings.day(day)
+        if not day_settings:
+            raise Exception(f"Day {day} not configured.")
+        return day_settings
+
+    def _load_day_tables(self, day) -> tuple:
+        """
+        Return the saved data of a day and its parsed tables, loaded and
+        parsed once for all the stages, or (None, None) if never saved.
+        """
+        if day not in self.loaded:
+            df = self.store.load_day(day)
+            self.loaded[day] = (df, TableAssignments(df) if df is not None else None)
+        return self.loaded[day]
+
+    def _load_day(self, day):
+        df, _ = self._load_day_tables(day)
+        if df is None:
+            raise Exception(f"No data saved for {day}, run the sync stage first.")
+        return df
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="FDB Post Reservation, headless mode.")
+    parser.add_argument("stages", nargs="+", choices=STAGES,
+                        help="the stages to run, always in the order: " + ", ".join(STAGES))
+    days_group = parser.add_mutually_exclusive_group(required=True)
+    days_group.add_argument("--day", action="append", help="a day to process (can be repeated)")
+    days_group.add_argument("--all", action="store_true", help="process all the configured days")
+    parser.add_argument("--settings", default="settings.ini", help="the settings file")
+    parser.add_argument("--output-dir", default="out", help="the output directory")
+    parser.add_argument("--force", action="store_true", help="ignore the caches")
+    parser.add_argument("--jobs", type=int, default=4, help="number of days processed in parallel")
+    args = parser.parse_args(argv)
+
+    settings = Settings(args.settings)
+    if not settings.get("sheets"):
+        print(f"Settings file {args.settings} not found or incomplete.", file=sys.stderr)
+        return EXIT_USAGE
+    configured_days = settings.days
+    days = configured_days if args.all else args.day
+    unknown = [day for day in days if day not in configured_days]
+    if unknown:
+        print(f"Days not configured: {', '.join(unknown)}.", file=sys.stderr)
+        return EXIT_USAGE
+
+    pipeline = Pipeline(settings, args.stages, days, output_dir=args.output_dir,
+                        force=args.force, jobs=args.jobs)
+    return pipeline.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,23 +1,32 @@
 # connection.py
 
+import datetime
+import hashlib
 import json
 import os
 import pickle
-from tkinter import messagebox
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-import requests
-from googleapiclient.discovery import build
+import threading
+import time
+from files import atomic_path
+
+# The Google and HTTP libraries are slow to import: they are imported when
+# first needed, so that the app window can appear before.
 
 
 class Connection:
     """
     Base class to manage the state of the connection.
+
+    The result of the last login is cached for `status_ttl` seconds, so that
+    repeated status queries (e.g. UI refreshes) do not hit the network.
     """
-    def __init__(self):
+    def __init__(self, status_ttl=60):
         self.state = False
         self.message = ""
+        self.status_ttl = status_ttl
+        self.last_check = None
+        # Status checks may run in worker threads: one login at a time.
+        self.refresh_lock = threading.Lock()
 
     def login(self):
         raise NotImplementedError("Subclasses should implement this method")
@@ -25,29 +34,198 @@ class Connection:
     def connect(self):
         raise NotImplementedError("Subclasses should implement this method")
 
+    def set_status_ttl(self, status_ttl):
+        """
+        Setter for the time (in seconds) a login result is considered valid.
+        """
+        self.status_ttl = status_ttl
+
+    def invalidate(self):
+        """
+        Drop the cached status, so that the next query performs a new login.
+        """
+        self.last_check = None
+
+    def is_stale(self):
+        """
+        Return True if the cached status is missing or older than the TTL.
+        """
+        return self.last_check is None \
+            or time.monotonic() - self.last_check >= self.status_ttl
+
+    def refresh(self, force=False):
+        """
+        Perform a login only if the cached status is stale (or if forced).
+        """
+        with self.refresh_lock:
+            if force or self.is_stale():
+                self.login()
+                self.last_check = time.monotonic()
+
     def get_state(self):
-        self.login()
+        self.refresh()
         return self.state
 
     def get_message(self):
-        self.login()
+        self.refresh()
         return self.message
 
+    def get_last_state(self):
+        """
+        Return the last known (state, message) without performing any login.
+        """
+        return self.state, self.message
+
+
+class CredentialManager:
+    """
+    Keep the Google credentials in memory and refresh them in the background
+    shortly before they expire, so that no user action waits for a refresh.
+
+    The token file is read again only if it was changed by someone else (e.g.
+    the headless CLI), and written atomically only when the token changes.
+    All the methods can be called from any thread.
+    """
+    def __init__(self, token_file='token.json', refresh_margin=300, retry_interval=60):
+        self.token_file = token_file
+        # Seconds before the expiry when the token is refreshed. It must be
+        # larger than the threshold google-auth uses to consider it expired.
+        self.refresh_margin = refresh_margin
+        self.retry_interval = retry_interval
+        self.creds = None
+        self.token_mtime = None
+        self.timer = None
+        self.lock = threading.RLock()
+
+    def set_token_file(self, token_file):
+        """
+        Setter for the token file path, the credentials are read again.
+        """
+        with self.lock:
+            if token_file != self.token_file:
+                self.token_file = token_file
+                self.creds = None
+                self.token_mtime = None
+                self._cancel_timer()
+
+    def get(self):
+        """
+        Return the current credentials, or None if there is no token.
+        The token is refreshed here only if the background refresh could not
+        do it in time (e.g. the computer was asleep).
+        """
+        with self.lock:
+            self._load()
+            if self.creds and not self.creds.valid and self.creds.refresh_token:
+                self._refresh()
+            return self.creds
+
+    def set(self, creds):
+        """
+        Replace the credentials (e.g. after a new OAuth login) and save them.
+        """
+        with self.lock:
+            self.creds = creds
+            self._save()
+            self._schedule()
+
+    def stop(self):
+        """
+        Stop the background refresh.
+        """
+        with self.lock:
+            self._cancel_timer()
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.token_file).st_mtime_ns
+        except FileNotFoundError:
+            self.creds = None
+            self.token_mtime = None
+            self._cancel_timer()
+            return
+        if mtime == self.token_mtime:
+            return
+        with open(self.token_file, 'rb') as token:
+            self.creds = pickle.load(token)
+        self.token_mtime = mtime
+        self._schedule()
+
+    def _save(self):
+        """
+        Write the token file atomically, so that a reader never sees it half written.
+        """
+        with atomic_path(self.token_file, private=True) as tmp_path, open(tmp_path, 'wb') as token:
+            pickle.dump(self.creds, token)
+        self.token_mtime = os.stat(self.token_file).st_mtime_ns
+
+    def _refresh(self):
+        from google.auth.transport.requests import Request
+        old_token = self.creds.token
+        self.creds.refresh(Request())
+        if self.creds.token != old_token:
+            self._save()
+        self._schedule()
+
+    def _schedule(self, delay=None):
+        self._cancel_timer()
+        if not self.creds or not self.creds.refresh_token:
+            return
+        if delay is None:
+            expiry = self.creds.expiry
+            if expiry is None:
+                return
+            # google-auth keeps the expiry as a naive UTC datetime.
+            now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            delay = max((expiry - now).total_seconds() - self.refresh_margin, 0)
+        self.timer = threading.Timer(delay, self._background_refresh)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _cancel_timer(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def _background_refresh(self):
+        with self.lock:
+            if not self.creds:
+                return
+            from google.auth.exceptions import RefreshError
+            try:
+                self._refresh()
+            except RefreshError as e:
+                # Revoked or invalid token, a new login is needed.
+                print(f"Google token refresh failed: {e}")
+            except Exception as e:
+                print(f"Google token refresh failed, retrying: {e}")
+                self._schedule(self.retry_interval)
+
 
 class GoogleConnection(Connection):
     """
     Handle Google OAuth login and connection status.
     """
-    def __init__(self, creds_file='google_secrets.json', token_file='token.json'):
-        super().__init__()
+    def __init__(self, creds_file='google_secrets.json', token_file='token.json', status_ttl=60):
+        super().__init__(status_ttl)
         self.creds_file = creds_file
         self.token_file = token_file
         self.scopes = ['openid',
                        'https://www.googleapis.com/auth/userinfo.email',
                        'https://www.googleapis.com/auth/spreadsheets',
                        'https://www.googleapis.com/auth/drive']
+        self.credentials = CredentialManager(token_file)
         self.creds = None
         self.account = None
+        # Refresh token the account was looked up for.
+        self.account_key = None
+
+        # Clients created on first use and reused until the account changes.
+        # API services are not thread safe, so each thread gets its own.
+        self.clients_lock = threading.Lock()
+        self.clients_key = None
+        self.services = threading.local()
+        self.session = None
 
     def set_creds_file(self, creds_file):
         """
@@ -66,6 +244,7 @@ class GoogleConnection(Connection):
         Setter for the token file path.
         """
         self.token_file = token_file
+        self.credentials.set_token_file(token_file)
 
     def get_token_file(self):
         """
@@ -79,6 +258,123 @@ class GoogleConnection(Connection):
         """
         return self.creds
 
+    def _update_account(self, token_file):
+        """
+        Set the account email of the current credentials, without network
+        calls when possible. The email is looked up only when the credentials
+        change: it is read from the ID token claims (given by the 'openid'
+        scope), or from the file saved next to the token; the userinfo API is
+        called only if neither has it. The account is None if unknown.
+        """
+        claims = {}
+        id_token = getattr(self.creds, 'id_token', None)
+        if id_token:
+            try:
+                from google.auth import jwt
+                claims = jwt.decode(id_token, verify=False)
+            except Exception:
+                claims = {}
+
+        # The refresh token identifies the authorization, but Google leaves it
+        # out when the user authorizes the app again: then the subject of the
+        # ID token, or the access token itself, is used.
+        key = None
+        if self.creds:
+            key = self.creds.refresh_token or claims.get('sub') or self.creds.token
+        if key is None:
+            self.account = None
+            self.account_key = None
+            return
+        if key == self.account_key and self.account:
+            return
+
+        account_file = token_file + '.account.json'
+        key_hash = hashlib.sha256(key.encode()).hexdigest()
+        account = claims.get('email')
+
+        cached = None
+        if os.path.exists(account_file):
+            try:
+                with open(account_file, 'r') as f:
+                    cached = json.load(f)
+            except (OSError, ValueError):
+                cached = None
+        if not account and cached and cached.get('key') == key_hash:
+            account = cached.get('email')
+
+        if not account:
+            try:
+                user_info_service = self._get_service('oauth2', 'v2')
+                account = user_info_service.userinfo().get().execute().get('email')
+            except Exception as e:
+                print(f"Google account not found: {e}")
+                account = None
+
+        if account and cached != {'key': key_hash, 'email': account}:
+            with open(account_file, 'w') as f:
+                json.dump({'key': key_hash, 'email': account}, f)
+        self.account = account
+        self.account_key = key
+
+    def _check_clients(self):
+        """
+        Drop the clients if they were created for other credentials.
+        The credential manager refreshes the same credentials in place, so
+        the clients are kept until the credentials are replaced.
+        """
+        key = self.creds
+        with self.clients_lock:
+            if key is not self.clients_key:
+                self.clients_key = key
+                self.services = threading.local()
+                if self.session:
+                    self.session.close()
+                self.session = None
+
+    def _get_service(self, name, version):
+        """
+        Return the API service of the current thread, building it if needed.
+        """
+        if self.creds is None:
+            raise Exception("Not connected to Google.")
+        self._check_clients()
+        services = self.services
+        service = getattr(services, name, None)
+        if service is None:
+            from googleapiclient.discovery import build
+            service = build(name, version, credentials=self.creds, cache_discovery=False)
+            setattr(services, name, service)
+        return service
+
+    def get_sheets_service(self):
+        """
+        Getter for the Google Sheets API service.
+        """
+        return self._get_service('sheets', 'v4')
+
+    def get_drive_service(self):
+        """
+        Getter for the Google Drive API service.
+        """
+        return self._get_service('drive', 'v3')
+
+    def get_session(self):
+        """
+        Getter for an authorized HTTP session, which keeps the connections
+        alive and can be shared between threads.
+        """
+        if self.creds is None:
+            raise Exception("Not connected to Google.")
+        self._check_clients()
+        with self.clients_lock:
+            if self.session is None:
+                from google.auth.transport.requests import AuthorizedSession
+                from requests.adapters import HTTPAdapter
+                self.session = AuthorizedSession(self.creds)
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10)
+                self.session.mount('https://', adapter)
+            return self.session
+
     def login(self, creds_file=None, token_file=None):
         """
         Handle Google login using OAuth2 and update the connection state and message.
@@ -88,27 +384,14 @@ class GoogleConnection(Connection):
         token_file = token_file or self.token_file
 
         try:
-            # Check if token exists and is valid
-            if os.path.exists(token_file):
-                with open(token_file, 'rb') as token:
-                    self.creds = pickle.load(token)
-            else:
-                self.creds = None
+            # The credentials are kept in memory and refreshed in the background
+            self.credentials.set_token_file(token_file)
+            self.creds = self.credentials.get()
 
             if self.creds and self.creds.valid:
                 self.state = True
-                user_info_service = build('oauth2', 'v2', credentials=self.creds)
-                self.account = user_info_service.userinfo().get().execute().get('email')
-                self.message = "Connected as " + self.account
-            elif not self.creds or not self.creds.valid:
-                # Refresh the token if expired
-                if self.creds and self.creds.expired and self.creds.refresh_token:
-                    self.creds.refresh(Request())
-                    # Save the refreshed credentials
-                    with open(token_file, 'wb') as token:
-                        pickle.dump(self.creds, token)
-                    self.state = True
-                    self.message = "Successfully refreshed Google credentials."
+                self._update_account(token_file)
+                self.message = "Connected as " + (self.account or "an unknown account")
             else:
                 self.state = False
                 self.message = "Google connection failed."
@@ -123,15 +406,19 @@ class GoogleConnection(Connection):
         Updates the connection state and message based on the result.
         Allows overriding of creds_file and token_file.
         """
+        from tkinter import messagebox
+
         creds_file = creds_file or self.creds_file
         token_file = token_file or self.token_file
 
         # First attempt to log in with existing credentials
+        self.invalidate()
         self.login(creds_file, token_file)
+        self.last_check = time.monotonic()
 
         if self.state:
             # If the login is successful, show the success message
-            message = f"Successfully connected to Google as {self.account}."
+            message = f"Successfully connected to Google as {self.account or 'an unknown account'}."
             messagebox.showinfo("Google Connection", message)
             return
 
@@ -142,18 +429,20 @@ class GoogleConnection(Connection):
 
         try:
             # Start the OAuth flow to authenticate the user
+            from google_auth_oauthlib.flow import InstalledAppFlow
             flow = InstalledAppFlow.from_client_secrets_file(creds_file, self.scopes)
-            self.creds = flow.run_local_server(port=0)
+            creds = flow.run_local_server(port=0)
 
             # Save the new credentials to the token file for future use
-            with open(token_file, 'wb') as token:
-                pickle.dump(self.creds, token)
-                print(f"Credentials saved to {token_file}")
+            self.credentials.set_token_file(token_file)
+            self.credentials.set(creds)
+            self.creds = creds
+            print(f"Credentials saved to {token_file}")
 
             self.state = True
-            user_info_service = build('oauth2', 'v2', credentials=self.creds)
-            self.account = user_info_service.userinfo().get().execute().get('email')
-            self.message = "Connected as " + self.account
+            self._update_account(token_file)
+            self.message = "Connected as " + (self.account or "an unknown account")
+            self.last_check = time.monotonic()
 
             # Save the new file paths (in case they were changed)
             self.set_creds_file(creds_file)
@@ -170,12 +459,14 @@ class WhatsAppConnection(Connection):
     """
     Handle WhatsApp API login and connection status.
     """
-    def __init__(self, token_file='whatsapp_secrets.json', phone_number_key='test'):
-        super().__init__()
+    def __init__(self, token_file='whatsapp_secrets.json', phone_number_key='test', status_ttl=60):
+        super().__init__(status_ttl)
         self.token_file = token_file
         self.phone_number_key = phone_number_key
         self.access_token = None
         self.phone_number_id = None
+        self.session = None
+        self.session_lock = threading.Lock()
 
     def set_token_file(self, token_file):
         """
@@ -201,6 +492,23 @@ class WhatsAppConnection(Connection):
         """
         return self.phone_number_key
 
+    def get_session(self):
+        """
+        Getter for an HTTP session authorized for the Graph API, which keeps
+        the connections alive and can be shared between threads.
+        """
+        if not self.access_token:
+            raise Exception("Not connected to WhatsApp.")
+        with self.session_lock:
+            if self.session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                self.session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=16)
+                self.session.mount('https://', adapter)
+            self.session.headers['Authorization'] = f'Bearer {self.access_token}'
+            return self.session
+
     def login(self, token_file=None, phone_number_key=None):
         """
         Handle WhatsApp login and update the connection state and message.
@@ -231,6 +539,7 @@ class WhatsAppConnection(Connection):
                 'Authorization': f'Bearer {self.access_token}'
             }
 
+            import requests
             response = requests.get(url, headers=headers)
 
             if response.status_code == 200:
@@ -263,10 +572,14 @@ class WhatsAppConnection(Connection):
         Updates the connection state and message based on the result.
         Allows overriding of token_file and phone_number_key.
         """
+        from tkinter import messagebox
+
         token_file = token_file or self.token_file
         phone_number_key = phone_number_key or self.phone_number_key
 
+        self.invalidate()
         self.login(token_file, phone_number_key)
+        self.last_check = time.monotonic()
 
         if self.state:
             self.state = True
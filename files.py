@@ -0,0 +1,43 @@
+# files.py
+
+import os
+import tempfile
+from contextlib import contextmanager
+
+
+def _umask_mode() -> int:
+    # The umask can only be read by setting it: do it once, at import.
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+# Permissions of a new file, as open() would create it.
+FILE_MODE = _umask_mode()
+
+
+@contextmanager
+def atomic_path(path: str, private: bool = False):
+    """
+    Write a file atomically, so that a reader never sees it half written.
+
+    Yields the path of a temporary file in the same directory, to be written
+    by the block. When the block completes the file is moved in place,
+    otherwise it is removed. The file gets the permissions of a new file
+    (0666 minus the umask), or 0600 if `private` (e.g. the tokens): the
+    temporary files are created readable only by their owner.
+
+        with atomic_path("settings.ini") as tmp_path, open(tmp_path, 'w') as f:
+            ...
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.chmod(tmp_path, 0o600 if private else FILE_MODE)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,327 @@
+# map_renderer.py
+
+import hashlib
+import json
+import os
+import time
+import utils
+from files import atomic_path
+
+# Fill of the tables booked by a reservation.
+OCCUPIED_COLOR = (255, 170, 170)
+# Page width of the map in mm (A4 landscape), the height follows the range.
+PAGE_WIDTH = 297
+MARGIN = 10
+
+GRID_FIELDS = ("sheets(properties(title),data(rowMetadata(pixelSize),columnMetadata(pixelSize),"
+               "rowData(values(formattedValue,effectiveFormat(backgroundColor)))),merges)")
+
+
+def google_get_map_grids(conn, file_id: str, map_ranges: dict, cache_dir: str,
+                         force: bool = False, progress=None, errors: dict = None) -> dict:
+    """
+    Get the values and background colours of the map ranges, to draw the
+    maps locally with `render_map_pdf`.
+
+    The grids are cached in `cache_dir` with the revision of the spreadsheet,
+    and only the grids missing or older than the current revision are
+    fetched, all with a single request. If the revision cannot be checked
+    (e.g. no network), the cached grids are used as they are.
+
+    Args:
+        conn (GoogleConnection): The connection providing the API clients.
+        file_id (str): The ID of the Google Sheet file.
+        map_ranges (dict): Map from a key (e.g. the day) to a tuple
+            (sheet name, range), e.g. ("Giovedi 04", utils.DEFAULT_MAP_RANGE).
+        cache_dir (str): Directory of the cached grids.
+        force (bool): Fetch the grids even if the spreadsheet did not change.
+        progress (callable): Optional callback called as progress(done, total, text).
+        errors (dict): If given, the keys whose grid cannot be fetched (e.g.
+            a renamed sheet) are left out of the result and their error is
+            stored here, instead of failing all of them.
+    Returns:
+        dict: Map from each key to its grid, a dict with keys "values",
+        "colors", "row_heights", "column_widths" and "merges".
+    """
+    if progress:
+        progress(0, 2, "Checking map revision...")
+    try:
+        revision = utils.google_get_revision(conn, file_id)
+        revision_error = None
+    except Exception as e:
+        revision, revision_error = None, e
+    os.makedirs(cache_dir, exist_ok=True)
+
+    grids = {}
+    missing = {}
+    for key, (sheet_name, map_range) in map_ranges.items():
+        path = _grid_path(cache_dir, file_id, sheet_name, map_range)
+        grid = None if force else _load_grid(path)
+        if grid is not None and (revision is None or grid.get("revision") == revision):
+            grids[key] = grid
+        else:
+            missing[key] = (sheet_name, map_range, path)
+    if not missing:
+        if revision_error:
+            print(f"Map revision not checked ({revision_error}), using the cached maps.")
+        return grids
+    if revision_error:
+        if errors is None:
+            raise revision_error
+        errors.update((key, revision_error) for key in missing)
+        return grids
+
+    if progress:
+        progress(1, 2, f"Downloading {len(missing)} maps...")
+    try:
+        grids.update(_fetch_grids(conn, file_id, missing, revision))
+    except Exception as e:
+        if errors is None:
+            raise
+        if len(missing) == 1:
+            errors.update((key, e) for key in missing)
+            return grids
+        # A single bad range (e.g. a renamed sheet) fails the whole request:
+        # fetch the ranges one by one to find out which ones.
+        print(f"Map download failed ({e}), downloading the maps one by one.")
+        for key, value in missing.items():
+            try:
+                grids.update(_fetch_grids(conn, file_id, {key: value}, revision))
+            except Exception as e:
+                errors[key] = e
+    return grids
+
+
+def generate_local_maps(conn, file_id: str, maps: dict, output_dir: str, cache_dir: str,
+                        force: bool = False, progress=None) -> dict:
+    """
+    Draw the maps of several days locally, fetching the grids not cached yet
+    with a single request.
+
+    Args:
+        conn (GoogleConnection): The connection providing the API clients.
+        file_id (str): The ID of the Google Sheet file.
+        maps (dict): Map from the day to a tuple (sheet name, range, IDs of
+            the booked tables).
+        output_dir (str): The directory to save the output files.
+        cache_dir (str): Directory of the cached grids.
+        force (bool): Fetch the grids even if the spreadsheet did not change.
+        progress (callable): Optional callback called as progress(done, total, text).
+    Returns:
+        dict: Map from the day to the path of its map PDF.
+    """
+    grids = google_get_map_grids(
+        conn, file_id, {day: (sheet_name, map_range) for day, (sheet_name, map_range, _) in maps.items()},
+        cache_dir, force=force, progress=progress)
+    paths = {}
+    for done, (day, (_, _, occupied)) in enumerate(maps.items()):
+        if progress:
+            progress(done, len(maps), f"Drawing map {day}...")
+        paths[day] = render_map_pdf(grids[day], os.path.join(output_dir, f"{day}-map.pdf"), occupied)
+    return paths
+
+
+def export_all_local_maps(conn, file_id: str, maps: dict, output_dir: str, cache_dir: str,
+                          force: bool = False, progress=None) -> list:
+    """
+    Like `generate_local_maps`, but a day that fails (e.g. its sheet was
+    renamed) does not stop the others. The results are the same as the ones
+    of `utils.google_export_all_maps`.
+
+    Returns:
+        list: For each day, a dict with keys "day", "path" (None if failed),
+        "seconds" and "error" (None if successful). The seconds include the
+        time of the shared download, split evenly between the days.
+    """
+    start = time.perf_counter()
+    errors = {}
+    grids = google_get_map_grids(
+        conn, file_id, {day: (sheet_name, map_range) for day, (sheet_name, map_range, _) in maps.items()},
+        cache_dir, force=force, progress=progress, errors=errors)
+    download_seconds = (time.perf_counter() - start) / max(len(maps), 1)
+
+    results = []
+    for done, (day, (_, _, occupied)) in enumerate(maps.items()):
+        if progress:
+            progress(done, len(maps), f"Drawing map {day}...")
+        start = time.perf_counter()
+        path, error = None, errors.get(day)
+        if error is None:
+            try:
+                path = render_map_pdf(grids[day], os.path.join(output_dir, f"{day}-map.pdf"), occupied)
+            except Exception as e:
+                error = e
+        results.append({"day": day, "path": path, "error": str(error) if error else None,
+                        "seconds": download_seconds + time.perf_counter() - start})
+
+    for result in results:
+        status = "failed: " + result["error"] if result["error"] else "ok"
+        print(f"Map {result['day']}: {status} in {result['seconds']:.1f}s")
+    return results
+
+
+def render_map_pdf(grid: dict, pdf_file_path: str, occupied=()) -> str:
+    """
+    Draw the map as a one page PDF: each cell with its background colour and
+    value, and the tables in `occupied` highlighted. A table is a cell whose
+    value is its table ID, e.g. "12A".
+
+    Args:
+        grid (dict): The grid, as returned by `google_get_map_grids`.
+        pdf_file_path (str): Path of the output PDF file.
+        occupied (iterable): The IDs of the booked tables.
+    Returns:
+        str: The path of the PDF file.
+    """
+    from fpdf import FPDF
+
+    occupied = {str(table_id).upper() for table_id in occupied}
+    column_widths = grid["column_widths"]
+    row_heights = grid["row_heights"]
+    scale = (PAGE_WIDTH - 2 * MARGIN) / max(sum(column_widths), 1)
+    page_height = sum(row_heights) * scale + 2 * MARGIN
+    xs = _offsets(column_widths, scale)
+    ys = _offsets(row_heights, scale)
+
+    pdf = FPDF(orientation="P", unit="mm", format=(PAGE_WIDTH, page_height))
+    pdf.set_auto_page_break(False)
+    pdf.add_page()
+    pdf.set_draw_color(200, 200, 200)
+    pdf.set_line_width(0.1)
+
+    # Cells covered by a merge (except its top left one) are not drawn.
+    spans = {}
+    covered = set()
+    for top, left, bottom, right in grid["merges"]:
+        spans[(top, left)] = (bottom, right)
+        covered.update((row, column) for row in range(top, bottom) for column in range(left, right)
+                       if (row, column) != (top, left))
+
+    for row, values in enumerate(grid["values"]):
+        for column, value in enumerate(values):
+            if (row, column) in covered:
+                continue
+            bottom, right = spans.get((row, column), (row + 1, column + 1))
+            x, y = xs[column], ys[row]
+            width, height = xs[right] - x, ys[bottom] - y
+            is_occupied = value.strip().upper() in occupied
+            color = OCCUPIED_COLOR if is_occupied else grid["colors"][row][column]
+            pdf.set_fill_color(*color)
+            pdf.rect(x, y, width, height, style="DF" if value or color != (255, 255, 255) else "D")
+            if value:
+                # Font size in points, from the cell height in mm.
+                pdf.set_font("Arial", "B" if is_occupied else "", max(min(height * 2.83 * 0.6, 10), 4))
+                pdf.set_xy(x, y)
+                pdf.cell(w=width, h=height, align="C",
+                         txt=value.encode("latin-1", "replace").decode("latin-1"))
+
+    # Write to a temporary file, then move it in place.
+    os.makedirs(os.path.dirname(os.path.abspath(pdf_file_path)), exist_ok=True)
+    with atomic_path(pdf_file_path) as tmp_path:
+        pdf.output(tmp_path, 'F')
+    print(f"File {pdf_file_path} written.")
+    return pdf_file_path
+
+
+def _fetch_grids(conn, file_id: str, missing: dict, revision: str) -> dict:
+    """
+    Fetch the grids of `missing`, a map from the key to (sheet name, range,
+    cache path), with a single request and cache them.
+    """
+    ranges = [f"{utils.quote_sheet_name(sheet_name)}!{map_range}"
+              for sheet_name, map_range, _ in missing.values()]
+    response = conn.get_sheets_service().spreadsheets().get(
+        spreadsheetId=file_id, ranges=ranges, includeGridData=True, fields=GRID_FIELDS).execute()
+
+    # The sheets come in spreadsheet order, each with the data of its ranges
+    # in the requested order.
+    sheets = {sheet["properties"]["title"]: sheet for sheet in response.get("sheets", [])}
+    grids = {}
+    used = {}
+    for key, (sheet_name, map_range, path) in missing.items():
+        sheet = sheets.get(sheet_name)
+        if sheet is None:
+            raise Exception(f"Sheet {sheet_name} not found.")
+        position = used.get(sheet_name, 0)
+        used[sheet_name] = position + 1
+        grid = _parse_grid(sheet["data"][position], sheet.get("merges", []), map_range)
+        grid["revision"] = revision
+        _save_grid(path, grid)
+        grids[key] = grid
+    return grids
+
+
+def _parse_grid(data: dict, merges: list, map_range: str) -> dict:
+    row_heights = [meta.get("pixelSize", 21) for meta in data.get("rowMetadata", [])]
+    column_widths = [meta.get("pixelSize", 100) for meta in data.get("columnMetadata", [])]
+    row_data = data.get("rowData", [])
+    values = []
+    colors = []
+    for row in range(len(row_heights)):
+        # Trailing empty rows and cells are omitted by the API.
+        cells = row_data[row].get("values", []) if row < len(row_data) else []
+        values.append([])
+        colors.append([])
+        for column in range(len(column_widths)):
+            cell = cells[column] if column < len(cells) else {}
+            values[-1].append(cell.get("formattedValue", ""))
+            background = cell.get("effectiveFormat", {}).get("backgroundColor")
+            # Missing components are 0, a missing colour is white.
+            colors[-1].append(tuple(round(background.get(component, 0) * 255)
+                                    for component in ("red", "green", "blue"))
+                              if background is not None else (255, 255, 255))
+
+    # Keep the merges inside the range, relative to its top left cell.
+    top, left = _range_start(map_range)
+    grid_merges = []
+    for merge in merges:
+        start_row = merge.get("startRowIndex", 0) - top
+        start_column = merge.get("startColumnIndex", 0) - left
+        end_row = merge.get("endRowIndex", 0) - top
+        end_column = merge.get("endColumnIndex", 0) - left
+        if 0 <= start_row and end_row <= len(row_heights) \
+                and 0 <= start_column and end_column <= len(column_widths):
+            grid_merges.append([start_row, start_column, end_row, end_column])
+
+    return {"values": values, "colors": colors, "row_heights": row_heights,
+            "column_widths": column_widths, "merges": grid_merges}
+
+
+def _range_start(map_range: str) -> tuple:
+    """
+    Return the (row, column) indexes of the top left cell of an A1 range.
+    """
+    start = map_range.split(":")[0].upper()
+    letters = "".join(char for char in start if char.isalpha())
+    digits = "".join(char for char in start if char.isdigit())
+    column = 0
+    for letter in letters:
+        column = column * 26 + ord(letter) - ord("A") + 1
+    return (int(digits) - 1 if digits else 0), column - 1
+
+
+def _offsets(sizes: list, scale: float) -> list:
+    offsets = [MARGIN]
+    for size in sizes:
+        offsets.append(offsets[-1] + size * scale)
+    return offsets
+
+
+def _grid_path(cache_dir: str, file_id: str, sheet_name: str, map_range: str) -> str:
+    key = hashlib.sha256(f"{file_id}/{sheet_name}/{map_range}".encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f"grid-{key}.json")
+
+
+def _load_grid(path: str):
+    try:
+        with open(path, 'r') as f:
+            grid = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    grid["colors"] = [[tuple(color) for color in row] for row in grid["colors"]]
+    return grid
+
+
+def _save_grid(path: str, grid: dict) -> None:
+    with atomic_path(path) as tmp_path, open(tmp_path, 'w') as f:
+        json.dump(grid, f)
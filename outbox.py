@@ -0,0 +1,138 @@
+# outbox.py
+
+import hashlib
+import sqlite3
+import time
+from contextlib import contextmanager
+import pandas as pd
+import phones
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    day TEXT NOT NULL,
+    phone TEXT NOT NULL,
+    message_hash TEXT NOT NULL,
+    status TEXT NOT NULL,
+    message_id TEXT,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (day, phone, message_hash)
+);
+"""
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+
+class Outbox:
+    """
+    Journal of the WhatsApp messages to send, saved in a SQLite database.
+
+    There is one entry for each (day, phone, message) with its status, and
+    each result is committed as soon as it is known. If a bulk send is
+    interrupted, running it again sends only the messages not sent yet.
+    """
+    def __init__(self, path="reservations.db"):
+        self.path = path
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+            self._migrate_phones(db)
+
+    @contextmanager
+    def _connect(self):
+        # A new connection for each operation, results are recorded from
+        # the sending threads.
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def _migrate_phones(self, db) -> None:
+        """
+        Convert the phones of the entries saved with the digits only (before
+        the numbers were normalized to E.164) to the E.164 format, so that
+        the messages already sent are not sent again. If both forms of the
+        same phone exist, the sent one is kept.
+        """
+        rows = db.execute("SELECT rowid, * FROM outbox WHERE phone NOT LIKE '+%'").fetchall()
+        if not rows:
+            return
+        normalized = phones.normalize_phones(pd.Series([row["phone"] for row in rows], dtype="string"))
+        migrated = 0
+        for row, phone, valid in zip(rows, normalized["phone"], normalized["valid"]):
+            # Invalid numbers were never sent, they are left as they are.
+            if not valid:
+                continue
+            existing = db.execute(
+                "SELECT rowid, status FROM outbox WHERE day = ? AND phone = ? AND message_hash = ?",
+                (row["day"], phone, row["message_hash"])).fetchone()
+            if existing is None:
+                db.execute("UPDATE outbox SET phone = ? WHERE rowid = ?", (phone, row["rowid"]))
+            else:
+                if row["status"] == SENT and existing["status"] != SENT:
+                    db.execute(
+                        "UPDATE outbox SET status = ?, message_id = ?, error = ?, attempts = ?, "
+                        "updated_at = ? WHERE rowid = ?",
+                        (row["status"], row["message_id"], row["error"], row["attempts"],
+                         row["updated_at"], existing["rowid"]))
+                db.execute("DELETE FROM outbox WHERE rowid = ?", (row["rowid"],))
+            migrated += 1
+        if migrated:
+            print(f"Outbox: {migrated} phone numbers converted to E.164.")
+
+    def enqueue(self, day: str, phones: list, message: str) -> list:
+        """
+        Add an entry for each phone not already in the outbox for this day
+        and message, then return the phones still to be sent.
+
+        Args:
+            day (str): The day of the reservations.
+            phones (list): The recipient phone numbers.
+            message (str): The text of the message.
+        Returns:
+            list: The phones whose message was not sent yet, in the given order.
+        """
+        message_hash = hash_message(message)
+        now = time.time()
+        with self._connect() as db:
+            db.executemany(
+                "INSERT OR IGNORE INTO outbox (day, phone, message_hash, status, updated_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(day, phone, message_hash, PENDING, now) for phone in phones])
+        statuses = self.statuses(day, message)
+        return [phone for phone in phones if statuses.get(phone) != SENT]
+
+    def record(self, day: str, message: str, result: dict) -> None:
+        """
+        Save the result of a send, as returned by `whatsapp.send_message`.
+        """
+        with self._connect() as db:
+            db.execute(
+                "UPDATE outbox SET status = ?, message_id = ?, error = ?, "
+                "attempts = attempts + 1, updated_at = ? "
+                "WHERE day = ? AND phone = ? AND message_hash = ?",
+                (SENT if result["status"] == "sent" else FAILED,
+                 result.get("message_id"), result.get("error"), time.time(),
+                 day, result["phone"], hash_message(message)))
+
+    def statuses(self, day: str, message: str) -> dict:
+        """
+        Return the map from phone to status of the entries of a day and message.
+        """
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT phone, status FROM outbox WHERE day = ? AND message_hash = ?",
+                (day, hash_message(message))).fetchall()
+        return {row["phone"]: row["status"] for row in rows}
+
+
+def hash_message(message: str) -> str:
+    """
+    Hash of the message text, to tell apart different messages to the same phone.
+    """
+    return hashlib.sha256(message.encode()).hexdigest()
@@ -0,0 +1,99 @@
+# phones.py
+
+import threading
+import numpy as np
+import pandas as pd
+
+# Country code added to the numbers written without one (Italy).
+DEFAULT_COUNTRY_CODE = "39"
+# Numbers with up to this many digits and no "+" or "00" are national ones.
+NATIONAL_MAX_DIGITS = 10
+# Columns added to the reservations by `add_phone_columns`.
+PHONE_COLUMN = "Telefono E164"
+VALID_COLUMN = "Telefono valido"
+
+# Normalized number and validity of each raw value, kept across reloads:
+# (raw value, default country code) -> (E.164 number, valid).
+_normalized = {}
+_normalized_lock = threading.Lock()
+
+
+def normalize_phones(phones: pd.Series, default_country: str = DEFAULT_COUNTRY_CODE) -> pd.DataFrame:
+    """
+    Convert phone numbers, as written in the worksheets, to E.164 (e.g.
+    "+393331234567") and flag the invalid ones.
+
+    Spaces, dots, dashes and brackets are removed, a "00" prefix becomes "+",
+    and national numbers get the default country code. A number is valid if
+    it has 8 to 15 digits, does not start with 0 after the "+" (country codes
+    never do) and has no letters (e.g. two numbers in the same cell are
+    invalid). Each distinct value is normalized once, with vectorized
+    string operations, and the result is remembered for the next reloads.
+
+    Args:
+        phones (pd.Series): The phone numbers.
+        default_country (str): The country code of the national numbers.
+    Returns:
+        pd.DataFrame: With the same index, the columns "phone" (the E.164
+        number, NA if missing or invalid) and "valid".
+    """
+    # Only the distinct values are normalized, missing values get the code -1.
+    codes, uniques = pd.factorize(phones)
+    uniques = uniques.tolist()
+    with _normalized_lock:
+        new = [value for value in uniques if (value, default_country) not in _normalized]
+    if new:
+        values = pd.Series(new, dtype=object).astype("string")
+        # Numbers read from the sheet as floats, e.g. "3331234567.0".
+        cleaned = values.str.strip().str.replace(r"\.0$", "", regex=True)
+        prefix_00 = cleaned.str.startswith("00")
+        international = cleaned.str.startswith("+") | prefix_00
+        digits = cleaned.str.replace(r"\D", "", regex=True)
+        digits = digits.mask(prefix_00, digits.str[2:])
+        national = ~international & (digits.str.len() <= NATIONAL_MAX_DIGITS)
+        digits = digits.mask(national, default_country + digits)
+        valid = digits.str.len().between(8, 15) & ~digits.str.startswith("0") \
+            & ~cleaned.str.contains(r"[A-Za-z]", regex=True)
+        # The invalid numbers have no E.164 form.
+        e164 = ("+" + digits).astype(object).where(valid, None)
+        with _normalized_lock:
+            _normalized.update(zip(
+                ((value, default_country) for value in new),
+                zip(e164.tolist(), valid.astype(bool).tolist())))
+
+    with _normalized_lock:
+        results = [_normalized[(value, default_country)] for value in uniques]
+    # One more entry for the missing values, taken by the code -1.
+    unique_phones = np.array([phone for phone, _ in results] + [None], dtype=object)
+    unique_valid = np.array([valid for _, valid in results] + [False], dtype=bool)
+    return pd.DataFrame({
+        "phone": pd.array(unique_phones[codes], dtype="string"),
+        "valid": unique_valid[codes],
+    }, index=phones.index)
+
+
+def add_phone_columns(df: pd.DataFrame, default_country: str = DEFAULT_COUNTRY_CODE) -> pd.DataFrame:
+    """
+    Return the reservations with the E.164 number and its validity in the
+    PHONE_COLUMN and VALID_COLUMN columns, computed from "Telefono".
+    """
+    if "Telefono" not in df.columns:
+        return df
+    normalized = normalize_phones(df["Telefono"], default_country)
+    return df.assign(**{PHONE_COLUMN: normalized["phone"], VALID_COLUMN: normalized["valid"]})
+
+
+def unique_valid_phones(df: pd.DataFrame, default_country: str = DEFAULT_COUNTRY_CODE) -> tuple:
+    """
+    Return the distinct valid E.164 numbers of the reservations, in order of
+    first appearance, so that one message goes to each phone.
+
+    Returns:
+        tuple: The list of the numbers, and the number of reservations with
+        a phone that is not valid.
+    """
+    normalized = normalize_phones(df["Telefono"], default_country)
+    written = df["Telefono"].astype("string").str.strip().fillna("") != ""
+    invalid = int((written & ~normalized["valid"]).sum())
+    phones = normalized.loc[normalized["valid"], "phone"]
+    return list(dict.fromkeys(phones)), invalid
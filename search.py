@@ -0,0 +1,168 @@
+# search.py
+
+import bisect
+import unicodedata
+from collections import defaultdict
+import pandas as pd
+from store import phone_key, table_ids
+
+# Minimum length of a query to use the trigrams instead of the name prefixes.
+TRIGRAM_SIZE = 3
+
+
+class SearchIndex:
+    """
+    In-memory index of the reservations of a day, to find them as the user
+    types: by the start of any word of "Nome", by any part of "Nome" (with
+    trigrams), by digits of "Telefono" and by the exact IDs in "Tavolo/i".
+
+    The entries are keyed by the dataframe index. `update()` re-indexes only
+    the rows added, changed or removed since the last call.
+    """
+    def __init__(self, df: pd.DataFrame = None):
+        # Values of each row as in the dataframe, to find the changed rows.
+        self.raw = {}
+        # Indexed values of each row: label -> (name, phone, tables).
+        self.rows = {}
+        # Position of each label in the dataframe, to return the results in order.
+        self.order = {}
+        # Sorted (word, label) of the names, for the prefix search.
+        self.words = []
+        self.name_trigrams = defaultdict(set)
+        self.phone_trigrams = defaultdict(set)
+        self.tables = defaultdict(set)
+        if df is not None:
+            self.update(df)
+
+    def update(self, df: pd.DataFrame) -> int:
+        """
+        Bring the index in line with the dataframe.
+
+        Returns:
+            int: The number of rows re-indexed.
+        """
+        current = dict(zip(df.index, zip(
+            _column(df, "Nome"), _column(df, "Telefono"), _column(df, "Tavolo/i"))))
+
+        # Only the changed rows are normalized and indexed again.
+        removed = [label for label, raw in self.raw.items() if current.get(label) != raw]
+        removed_words = set()
+        for label in removed:
+            removed_words.update(self._remove(label))
+            del self.raw[label]
+        added_words = []
+        added = [label for label in current if label not in self.raw]
+        for label in added:
+            name, phone, tables = current[label]
+            self.raw[label] = current[label]
+            added_words.extend(self._add(label, (
+                normalize_name(name), phone_key(phone), tuple(table_ids(tables)))))
+
+        # The word list is sorted once for all the changed rows.
+        if removed_words:
+            self.words = [pair for pair in self.words if pair not in removed_words]
+        if added_words:
+            self.words = sorted(self.words + added_words)
+        self.order = {label: position for position, label in enumerate(df.index)}
+        return len(removed) + len(added)
+
+    def search(self, query: str, limit: int = None) -> list:
+        """
+        Return the labels of the rows matching the query, in dataframe order.
+
+        A query matches a row if it is one of its table IDs, a part of its
+        phone number (3+ digits), the start of a word of its name or, from
+        3 characters, any part of its name.
+        """
+        query = query.strip()
+        if not query:
+            return []
+        labels = set(self.tables.get(query.upper(), ()))
+
+        digits = phone_key(query)
+        if len(digits) >= TRIGRAM_SIZE and not any(char.isalpha() for char in query):
+            labels |= self._substring(self.phone_trigrams, digits, 1)
+
+        name = normalize_name(query)
+        if name:
+            labels |= self._prefix(name)
+            if len(name) >= TRIGRAM_SIZE:
+                labels |= self._substring(self.name_trigrams, name, 0)
+
+        results = sorted(labels, key=lambda label: self.order.get(label, 0))
+        return results[:limit] if limit else results
+
+    def _prefix(self, prefix: str) -> set:
+        labels = set()
+        position = bisect.bisect_left(self.words, (prefix,))
+        while position < len(self.words) and self.words[position][0].startswith(prefix):
+            labels.add(self.words[position][1])
+            position += 1
+        return labels
+
+    def _substring(self, trigrams: dict, text: str, field: int) -> set:
+        matches = [trigrams.get(trigram) for trigram in _trigrams(text)]
+        if not all(matches):
+            return set()
+        # Intersect starting from the rarest trigram.
+        matches.sort(key=len)
+        candidates = set(matches[0])
+        for labels in matches[1:]:
+            candidates &= labels
+            if not candidates:
+                return set()
+        # Trigrams match in any order: check the whole text.
+        return {label for label in candidates if text in self.rows[label][field]}
+
+    def _add(self, label, values) -> list:
+        """
+        Index a row, returning its (word, label) pairs to add to the words.
+        """
+        name, phone, tables = values
+        self.rows[label] = values
+        for trigram in _trigrams(name):
+            self.name_trigrams[trigram].add(label)
+        for trigram in _trigrams(phone):
+            self.phone_trigrams[trigram].add(label)
+        for table_id in tables:
+            self.tables[table_id].add(label)
+        return [(word, label) for word in set(name.split())]
+
+    def _remove(self, label) -> list:
+        """
+        Remove a row from the index, returning its (word, label) pairs to
+        remove from the words.
+        """
+        name, phone, tables = self.rows.pop(label)
+        for trigrams, text in ((self.name_trigrams, name), (self.phone_trigrams, phone)):
+            for trigram in _trigrams(text):
+                trigrams[trigram].discard(label)
+                if not trigrams[trigram]:
+                    del trigrams[trigram]
+        for table_id in tables:
+            self.tables[table_id].discard(label)
+            if not self.tables[table_id]:
+                del self.tables[table_id]
+        return [(word, label) for word in set(name.split())]
+
+
+def normalize_name(name) -> str:
+    """
+    Lowercase the name and remove accents and extra spaces, so that
+    "Nicolò  Rossi" is found typing "nicolo r".
+    """
+    if name is None or name is pd.NA or (isinstance(name, float) and pd.isna(name)):
+        return ""
+    name = unicodedata.normalize("NFKD", str(name))
+    name = "".join(char for char in name if not unicodedata.combining(char))
+    return " ".join(name.casefold().split())
+
+
+def _column(df: pd.DataFrame, column: str) -> pd.Series:
+    if column in df.columns:
+        return df[column].astype(object).where(df[column].notna(), None)
+    return pd.Series([None] * len(df), index=df.index, dtype=object)
+
+
+def _trigrams(text: str) -> set:
+    return {text[i:i + TRIGRAM_SIZE] for i in range(len(text) - TRIGRAM_SIZE + 1)}
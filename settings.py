@@ -0,0 +1,171 @@
+# settings.py
+
+import configparser
+import os
+import threading
+from files import atomic_path
+
+
+def load_settings(path='settings.ini') -> dict:
+    """
+    Read the settings file as a dict of sections, each one a dict of strings.
+
+    Args:
+        path (str): Path of the settings file.
+    Returns:
+        dict: The settings.
+    """
+    config = configparser.ConfigParser()
+    config.read(path)
+    settings = dict()
+    for section in config.sections():
+        items = config.items(section)
+        settings[section] = dict(items)
+    return settings
+
+
+def save_settings(settings: dict, path='settings.ini') -> None:
+    """
+    Write a dict of sections to the settings file, atomically.
+
+    Args:
+        settings (dict): The settings, a dict of sections of strings.
+        path (str): Path of the settings file.
+    """
+    config = configparser.ConfigParser()
+    for section, items in settings.items():
+        config.add_section(section)
+        for key, value in items.items():
+            config.set(section, key, str(value))
+
+    with atomic_path(path) as tmp_path, open(tmp_path, 'w') as f:
+        config.write(f)
+
+
+class Settings:
+    """
+    The settings file, parsed once and kept in memory.
+
+    `reload()` parses the file again only if its modification time changed,
+    and notifies the subscribers with the set of (section, key) that changed,
+    so that only the affected caches and connections are reset. The sections
+    can be read like a dict (`settings.get("API")`), the typed getters convert
+    the values and apply the defaults.
+    """
+    def __init__(self, path='settings.ini'):
+        self.path = path
+        self.data = {}
+        self.mtime = None
+        self.subscribers = []
+        self.lock = threading.Lock()
+        self.reload()
+
+    def subscribe(self, callback) -> None:
+        """
+        Register a callback, called as callback(changed) after a reload that
+        changed something, with `changed` the set of (section, key) tuples.
+        """
+        self.subscribers.append(callback)
+
+    def reload(self, force=False) -> set:
+        """
+        Parse the settings file again if it changed since the last time (or if
+        forced), and notify the subscribers.
+
+        Returns:
+            set: The (section, key) tuples whose value changed, added or removed.
+        """
+        with self.lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if not force and mtime == self.mtime and self.data:
+                return set()
+            data = load_settings(self.path)
+            changed = diff_settings(self.data, data)
+            self.data = data
+            self.mtime = mtime
+
+        if changed:
+            for callback in self.subscribers:
+                callback(changed)
+        return changed
+
+    def save(self, data: dict) -> set:
+        """
+        Write the settings file and reload it.
+
+        Args:
+            data (dict): The new settings, a dict of sections of strings.
+        Returns:
+            set: The (section, key) tuples that changed.
+        """
+        save_settings(data, self.path)
+        return self.reload(force=True)
+
+    def get(self, section: str, default=None):
+        return self.data.get(section, default)
+
+    def __getitem__(self, section: str) -> dict:
+        return self.data[section]
+
+    def __contains__(self, section: str) -> bool:
+        return section in self.data
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def items(self):
+        return self.data.items()
+
+    def get_str(self, section: str, key: str, default: str = None) -> str:
+        return self.data.get(section, {}).get(key, default)
+
+    def get_int(self, section: str, key: str, default: int = None) -> int:
+        value = self.data.get(section, {}).get(key)
+        return default if value in (None, "") else int(value)
+
+    def get_float(self, section: str, key: str, default: float = None) -> float:
+        value = self.data.get(section, {}).get(key)
+        return default if value in (None, "") else float(value)
+
+    def get_bool(self, section: str, key: str, default: bool = False) -> bool:
+        value = self.data.get(section, {}).get(key)
+        if value in (None, ""):
+            return default
+        return value.strip().lower() in ("1", "true", "yes", "on")
+
+    def get_list(self, section: str, key: str, default: list = None) -> list:
+        value = self.data.get(section, {}).get(key)
+        if value in (None, ""):
+            return list(default or [])
+        return [item.strip() for item in value.split(",") if item.strip()]
+
+    @property
+    def file_id(self) -> str:
+        return self.get_str("sheets", "file_id")
+
+    @property
+    def days(self) -> list:
+        return self.get_list("sheets", "days")
+
+    def day(self, day: str) -> dict:
+        """
+        Return the section of a day, or an empty dict if not configured.
+        """
+        return self.data.get("day-" + day, {})
+
+
+def diff_settings(old: dict, new: dict) -> set:
+    """
+    Return the (section, key) tuples whose value differs between two settings.
+    """
+    changed = set()
+    for section in old.keys() | new.keys():
+        old_items = old.get(section, {})
+        new_items = new.get(section, {})
+        for key in old_items.keys() | new_items.keys():
+            if old_items.get(key) != new_items.get(key):
+                changed.add((section, key))
+    return changed
@@ -0,0 +1,217 @@
+# store.py
+
+import json
+import re
+import sqlite3
+import time
+from contextlib import contextmanager
+import pandas as pd
+import phones
+
+# Map between the dataframe columns and the database columns.
+COLUMNS = {
+    "Nome": "nome",
+    "Telefono": "telefono",
+    "Num persone": "num_persone",
+    "Num tavoli": "num_tavoli",
+    "Tavolo/i": "tavoli",
+    "Num spiedi": "num_spiedi",
+}
+INTEGER_COLUMNS = ["Num persone", "Num tavoli", "Num spiedi"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    day TEXT PRIMARY KEY,
+    columns TEXT NOT NULL,
+    saved_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reservations (
+    day TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    nome TEXT,
+    telefono TEXT,
+    num_persone INTEGER,
+    num_tavoli INTEGER,
+    tavoli TEXT,
+    num_spiedi INTEGER,
+    nome_key TEXT,
+    telefono_key TEXT,
+    PRIMARY KEY (day, row)
+);
+CREATE INDEX IF NOT EXISTS reservations_nome ON reservations (day, nome_key);
+CREATE INDEX IF NOT EXISTS reservations_telefono ON reservations (day, telefono_key);
+CREATE TABLE IF NOT EXISTS reservation_tables (
+    day TEXT NOT NULL,
+    row INTEGER NOT NULL,
+    table_id TEXT NOT NULL,
+    PRIMARY KEY (day, row, table_id)
+);
+CREATE INDEX IF NOT EXISTS reservation_tables_id ON reservation_tables (day, table_id);
+"""
+
+
+class ReservationStore:
+    """
+    Local copy of the downloaded reservations, saved in a SQLite database.
+
+    The last download of each day is kept, so that the data is available
+    after a restart or without network. Reservations can be looked up by
+    name prefix, phone number and table ID.
+    """
+    def __init__(self, path="reservations.db"):
+        self.path = path
+        with self._connect() as db:
+            db.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        # A new connection for each operation, so the store can be used
+        # from the worker threads too.
+        db = sqlite3.connect(self.path)
+        db.row_factory = sqlite3.Row
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def save_day(self, day: str, df: pd.DataFrame) -> None:
+        """
+        Replace the snapshot of a day with the given reservations.
+
+        Args:
+            day (str): The day of the reservations.
+            df (pd.DataFrame): The reservations, as downloaded from the worksheet.
+        """
+        columns = [col for col in df.columns if col in COLUMNS]
+        rows = []
+        tables = []
+        for row, values in zip(df.index, df[columns].itertuples(index=False)):
+            values = dict(zip(columns, values))
+            record = {COLUMNS[col]: self._to_db(values.get(col)) for col in COLUMNS}
+            record["day"] = day
+            record["row"] = int(row)
+            record["nome_key"] = name_key(record["nome"])
+            record["telefono_key"] = phone_key(record["telefono"])
+            rows.append(record)
+            for table_id in table_ids(record["tavoli"]):
+                tables.append((day, int(row), table_id))
+
+        db_columns = ["day", "row"] + list(COLUMNS.values()) + ["nome_key", "telefono_key"]
+        with self._connect() as db:
+            db.execute("DELETE FROM reservations WHERE day = ?", (day,))
+            db.execute("DELETE FROM reservation_tables WHERE day = ?", (day,))
+            db.executemany(
+                f"INSERT INTO reservations ({', '.join(db_columns)}) "
+                f"VALUES ({', '.join(':' + col for col in db_columns)})", rows)
+            db.executemany(
+                "INSERT OR IGNORE INTO reservation_tables (day, row, table_id) VALUES (?, ?, ?)",
+                tables)
+            db.execute(
+                "INSERT OR REPLACE INTO snapshots (day, columns, saved_at) VALUES (?, ?, ?)",
+                (day, json.dumps(columns), time.time()))
+        print(f"Saved {len(rows)} reservations of {day}.")
+
+    def load_day(self, day: str):
+        """
+        Load the last snapshot of a day.
+
+        Args:
+            day (str): The day of the reservations.
+        Returns:
+            pd.DataFrame: The reservations, with the phone columns added by
+            `phones.add_phone_columns`, or None if the day was never saved.
+        """
+        with self._connect() as db:
+            snapshot = db.execute(
+                "SELECT columns FROM snapshots WHERE day = ?", (day,)).fetchone()
+            if snapshot is None:
+                return None
+            rows = db.execute(
+                "SELECT * FROM reservations WHERE day = ? ORDER BY row", (day,)).fetchall()
+        return phones.add_phone_columns(self._to_df(json.loads(snapshot["columns"]), rows))
+
+    def days(self) -> list:
+        """
+        Return the saved days, the most recent first.
+        """
+        with self._connect() as db:
+            rows = db.execute("SELECT day FROM snapshots ORDER BY saved_at DESC").fetchall()
+        return [row["day"] for row in rows]
+
+    def find_by_name(self, day: str, prefix: str) -> pd.DataFrame:
+        """
+        Find the reservations of a day whose name starts with `prefix`
+        (case insensitive).
+        """
+        key = name_key(prefix)
+        return self._query(
+            day, "SELECT * FROM reservations WHERE day = ? AND nome_key >= ? AND nome_key < ?",
+            (day, key, key + "\uffff"))
+
+    def find_by_phone(self, day: str, phone: str) -> pd.DataFrame:
+        """
+        Find the reservations of a day with the given phone number.
+        Only the digits of the number are compared.
+        """
+        return self._query(
+            day, "SELECT * FROM reservations WHERE day = ? AND telefono_key = ?",
+            (day, phone_key(phone)))
+
+    def find_by_table(self, day: str, table_id: str) -> pd.DataFrame:
+        """
+        Find the reservations of a day that booked the given table.
+        """
+        return self._query(
+            day, "SELECT r.* FROM reservations r JOIN reservation_tables t "
+                 "ON r.day = t.day AND r.row = t.row WHERE t.day = ? AND t.table_id = ?",
+            (day, table_id.strip().upper()))
+
+    def _query(self, day, query, params) -> pd.DataFrame:
+        with self._connect() as db:
+            snapshot = db.execute(
+                "SELECT columns FROM snapshots WHERE day = ?", (day,)).fetchone()
+            rows = db.execute(query + " ORDER BY row", params).fetchall()
+        columns = json.loads(snapshot["columns"]) if snapshot else list(COLUMNS)
+        return self._to_df(columns, rows)
+
+    def _to_df(self, columns, rows) -> pd.DataFrame:
+        df = pd.DataFrame(
+            {col: [row[COLUMNS[col]] for row in rows] for col in columns},
+            index=[row["row"] for row in rows])
+        for col in columns:
+            if col in INTEGER_COLUMNS:
+                df[col] = df[col].astype("Int64")
+            else:
+                df[col] = df[col].astype("string")
+        return df
+
+    def _to_db(self, value):
+        if pd.isna(value):
+            return None
+        if isinstance(value, str):
+            return value
+        return int(value)
+
+
+def name_key(name) -> str:
+    """
+    Normalize a name for the lookups.
+    """
+    return " ".join(str(name).split()).upper() if name else ""
+
+
+def phone_key(phone) -> str:
+    """
+    Normalize a phone number for the lookups, keeping only its digits.
+    """
+    return re.sub(r"\D", "", str(phone)) if phone else ""
+
+
+def table_ids(tables) -> list:
+    """
+    Split the content of the "Tavolo/i" column in the single table IDs.
+    """
+    if not tables:
+        return []
+    return [table_id.strip().upper() for table_id in str(tables).split(";") if table_id.strip()]
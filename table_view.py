@@ -0,0 +1,278 @@
+# table_view.py
+
+import tkinter as tk
+from tkinter import font as tkfont, ttk
+import pandas as pd
+
+
+class TableModel:
+    """
+    The dataframe shown by a TableView. The rows are formatted only when
+    they are shown. If `positions` is set, only those rows are shown.
+    """
+    def __init__(self, df: pd.DataFrame = None):
+        self.df = df if df is not None else pd.DataFrame()
+        self.positions = None
+
+    def row_count(self) -> int:
+        return len(self.df) if self.positions is None else len(self.positions)
+
+    def label(self, position: int):
+        """
+        Return the index label of the shown row at `position`.
+        """
+        if self.positions is not None:
+            position = self.positions[position]
+        return self.df.index[position]
+
+    def columns(self) -> list:
+        return [str(column) for column in self.df.columns]
+
+    def get_rows(self, start: int, stop: int) -> list:
+        """
+        Return the rows from position `start` to `stop` as lists of strings.
+        """
+        if self.positions is None:
+            rows = self.df.iloc[start:stop]
+        else:
+            rows = self.df.iloc[self.positions[start:stop]]
+        if rows.empty:
+            return []
+        rows = rows.astype(object).where(rows.notna(), "")
+        return [[str(value) for value in row] for row in rows.itertuples(index=False)]
+
+
+class TableView(tk.Frame):
+    """
+    Read-only table drawn on a canvas, which renders only the visible rows.
+
+    The canvas keeps one set of items for each row that fits in the window,
+    and scrolling just changes their text, so the cost of a redraw does not
+    depend on the number of rows. A column can be changed without showing
+    the whole dataframe again.
+    """
+    def __init__(self, parent, df: pd.DataFrame = None, row_height=22, min_width=40, max_width=300,
+                 on_select=None, **kwargs):
+        super().__init__(parent, **kwargs)
+        self.model = TableModel(df)
+        self.row_height = row_height
+        self.min_width = min_width
+        self.max_width = max_width
+        self.on_select = on_select
+
+        self.font = tkfont.nametofont("TkDefaultFont")
+        self.char_width = max(self.font.measure("0"), 1)
+        self.column_widths = []
+        self.first_row = 0
+        self.selected_row = None
+        # Items of each visible row: (background, [text of each column]).
+        self.slots = []
+        self.slots_for_columns = None
+
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(1, weight=1)
+        self.header = tk.Canvas(self, height=row_height, bg="#e4e4e4", highlightthickness=0)
+        self.header.grid(row=0, column=0, sticky="ew")
+        self.body = tk.Canvas(self, bg="white", highlightthickness=0, takefocus=1)
+        self.body.grid(row=1, column=0, sticky="nsew")
+        self.vsb = ttk.Scrollbar(self, orient="vertical", command=self.yview)
+        self.vsb.grid(row=1, column=1, sticky="ns")
+        self.hsb = ttk.Scrollbar(self, orient="horizontal", command=self.xview)
+        self.hsb.grid(row=2, column=0, sticky="ew")
+        self.body.configure(xscrollcommand=self.hsb.set)
+
+        self.body.bind("<Configure>", lambda event: self.layout())
+        self.body.bind("<MouseWheel>", lambda event: self.yview("scroll", -event.delta // 120, "units"))
+        self.body.bind("<Button-4>", lambda event: self.yview("scroll", -3, "units"))
+        self.body.bind("<Button-5>", lambda event: self.yview("scroll", 3, "units"))
+        self.body.bind("<Button-1>", self.on_click)
+        self.body.bind("<Up>", lambda event: self.move_selection(-1))
+        self.body.bind("<Down>", lambda event: self.move_selection(1))
+        self.body.bind("<Prior>", lambda event: self.yview("scroll", -1, "pages"))
+        self.body.bind("<Next>", lambda event: self.yview("scroll", 1, "pages"))
+
+        self.set_dataframe(self.model.df)
+
+    def set_dataframe(self, df: pd.DataFrame) -> None:
+        """
+        Show another dataframe, keeping the scroll position if possible.
+        """
+        columns_changed = list(df.columns) != list(self.model.df.columns) or not self.column_widths
+        self.model.df = df
+        self.model.positions = None
+        # The selected position refers to the previous rows.
+        self.selected_row = None
+        # The new dataframe can be shorter than the scroll position.
+        self.first_row = max(min(self.first_row, self.model.row_count() - len(self.slots)), 0)
+        if columns_changed:
+            self.first_row = 0
+            self.measure_columns()
+            self.draw_header()
+        self.layout()
+
+    def clear(self) -> None:
+        self.set_dataframe(pd.DataFrame())
+
+    def set_filter(self, labels) -> None:
+        """
+        Show only the rows with the given index labels (None to show all).
+        """
+        positions = None if labels is None else list(self.model.df.index.get_indexer(labels))
+        if positions == self.model.positions:
+            return
+        self.model.positions = positions
+        self.first_row = 0
+        self.selected_row = None
+        self.update_scrollbar()
+        self.render()
+
+    def set_column(self, column, values: pd.Series) -> None:
+        """
+        Change the values of a column, or add it, keeping the rows shown,
+        the filter and the scroll position.
+        """
+        added = column not in self.model.df.columns
+        self.model.df[column] = values
+        if added:
+            self.measure_columns()
+            self.draw_header()
+            self.layout()
+        else:
+            self.render()
+
+    def measure_columns(self, sample_size=200) -> None:
+        """
+        Size each column on its header and on the first rows, not on all of them.
+        """
+        columns = self.model.columns()
+        rows = self.model.get_rows(0, sample_size)
+        self.column_widths = []
+        for i, column in enumerate(columns):
+            longest = max([len(column)] + [len(row[i]) for row in rows])
+            width = (longest + 2) * self.char_width
+            self.column_widths.append(min(max(width, self.min_width), self.max_width))
+
+    def draw_header(self) -> None:
+        self.header.delete("all")
+        x = 0
+        for column, width in zip(self.model.columns(), self.column_widths):
+            self.header.create_rectangle(x, 0, x + width, self.row_height, outline="#b0b0b0", fill="#e4e4e4")
+            self.header.create_text(x + 4, self.row_height // 2, text=self.truncate(column, width),
+                                    anchor="w", font=self.font)
+            x += width
+        self.header.configure(scrollregion=(0, 0, x, self.row_height))
+
+    def layout(self) -> None:
+        """
+        Create the items of the rows that fit in the window, then render them.
+        Called when the window is resized or the columns change.
+        """
+        visible = max(self.body.winfo_height() // self.row_height + 1, 1)
+        if len(self.slots) != visible or self.slots_for_columns != self.column_widths:
+            self.body.delete("all")
+            self.slots = []
+            total_width = sum(self.column_widths)
+            for i in range(visible):
+                y = i * self.row_height
+                background = self.body.create_rectangle(0, y, max(total_width, 1), y + self.row_height,
+                                                        width=0, fill="white")
+                texts = []
+                x = 0
+                for width in self.column_widths:
+                    texts.append(self.body.create_text(x + 4, y + self.row_height // 2, text="",
+                                                       anchor="w", font=self.font))
+                    x += width
+                self.slots.append((background, texts))
+            self.slots_for_columns = list(self.column_widths)
+            self.body.configure(scrollregion=(0, 0, total_width, visible * self.row_height))
+        self.update_scrollbar()
+        self.render()
+
+    def render(self) -> None:
+        """
+        Show the rows from `first_row` in the existing items.
+        """
+        rows = self.model.get_rows(self.first_row, self.first_row + len(self.slots))
+        for i, (background, texts) in enumerate(self.slots):
+            position = self.first_row + i
+            if i >= len(rows):
+                self.body.itemconfigure(background, state="hidden")
+                for text in texts:
+                    self.body.itemconfigure(text, state="hidden")
+                continue
+            if position == self.selected_row:
+                fill = "#cce0ff"
+            else:
+                fill = "white" if position % 2 == 0 else "#f4f4f4"
+            self.body.itemconfigure(background, state="normal", fill=fill)
+            for text, value, width in zip(texts, rows[i], self.column_widths):
+                self.body.itemconfigure(text, state="normal", text=self.truncate(value, width))
+
+    def truncate(self, value: str, width: int) -> str:
+        max_chars = max(width // self.char_width - 1, 1)
+        value = value.replace("\n", " ")
+        return value if len(value) <= max_chars else value[:max_chars - 1] + "…"
+
+    def update_scrollbar(self) -> None:
+        count = self.model.row_count()
+        if count == 0:
+            self.vsb.set(0, 1)
+            return
+        self.vsb.set(self.first_row / count, min((self.first_row + len(self.slots) - 1) / count, 1))
+
+    def yview(self, *args) -> None:
+        """
+        Scroll command of the vertical scrollbar: moves `first_row`.
+        """
+        count = self.model.row_count()
+        page = max(len(self.slots) - 1, 1)
+        first_row = self.first_row
+        if args[0] == "moveto":
+            first_row = int(float(args[1]) * count)
+        elif args[0] == "scroll":
+            step = page if args[2] == "pages" else 1
+            first_row += int(args[1]) * step
+        first_row = max(min(first_row, count - page), 0)
+        if first_row != self.first_row:
+            self.first_row = first_row
+            self.update_scrollbar()
+            self.render()
+
+    def xview(self, *args) -> None:
+        self.body.xview(*args)
+        self.header.xview(*args)
+
+    def see(self, position: int) -> None:
+        """
+        Scroll so that the row at `position` is visible.
+        """
+        page = max(len(self.slots) - 1, 1)
+        if position < self.first_row:
+            self.yview("moveto", position / max(self.model.row_count(), 1))
+        elif position >= self.first_row + page:
+            self.first_row = max(position - page + 1, 0)
+            self.update_scrollbar()
+            self.render()
+
+    def select_row(self, position) -> None:
+        """
+        Highlight the row at `position` (None to clear the selection).
+        """
+        self.selected_row = position
+        if position is not None:
+            self.see(position)
+        self.render()
+        if self.on_select and position is not None:
+            self.on_select(self.model.label(position))
+
+    def move_selection(self, step: int) -> None:
+        count = self.model.row_count()
+        if count:
+            current = self.selected_row if self.selected_row is not None else self.first_row - step
+            self.select_row(max(min(current + step, count - 1), 0))
+
+    def on_click(self, event) -> None:
+        self.body.focus_set()
+        position = self.first_row + int(self.body.canvasy(event.y)) // self.row_height
+        if position < self.model.row_count():
+            self.select_row(position)
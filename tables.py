@@ -0,0 +1,97 @@
+# tables.py
+
+import pandas as pd
+
+# Table IDs are a number followed by a letter, e.g. "12A".
+TABLE_ID_PATTERN = r"^(\d+)([A-Z])$"
+
+
+class TableAssignments:
+    """
+    The tables booked by the reservations of a day, parsed once from the
+    "Tavolo/i" column (e.g. "12A;13B").
+
+    `ids` has one row for each table ID of each reservation, in order, with
+    the columns "reservation" (the dataframe index), "table_id", "number" and
+    "letter" (NA if the ID is malformed). `occupancy` maps each table ID to
+    the reservations booking it. The checks are computed in the same pass:
+    tables booked more than once, reservations whose "Num tavoli" differs
+    from the number of IDs listed, and malformed IDs.
+    """
+    def __init__(self, df: pd.DataFrame):
+        tables = df["Tavolo/i"] if "Tavolo/i" in df.columns else pd.Series(pd.NA, index=df.index)
+        ids = tables.astype("string").str.upper().str.split(";").explode().str.strip()
+        ids = ids[ids.fillna("") != ""]
+        parts = ids.str.extract(TABLE_ID_PATTERN)
+
+        self.ids = pd.DataFrame({
+            "reservation": ids.index,
+            "table_id": ids.to_numpy(),
+            "number": pd.to_numeric(parts[0]).astype("Int64").to_numpy(),
+            "letter": parts[1].astype("string").to_numpy(),
+        })
+        self.occupancy = self.ids.groupby("table_id", sort=False)["reservation"].agg(list).to_dict()
+
+        # Tables listed by more than one reservation (twice by the same one counts too).
+        self.double_booked = {table_id: reservations for table_id, reservations in self.occupancy.items()
+                              if len(reservations) > 1}
+
+        listed = self.ids.groupby("reservation", sort=False).size().reindex(df.index, fill_value=0)
+        declared = df["Num tavoli"].astype("Int64") if "Num tavoli" in df.columns \
+            else pd.Series(pd.NA, index=df.index, dtype="Int64")
+        mismatch = declared.notna() & (declared != listed)
+        self.mismatches = pd.DataFrame({"declared": declared[mismatch], "listed": listed[mismatch]})
+
+        self.malformed = self.ids.loc[self.ids["number"].isna(), ["reservation", "table_id"]]
+
+    def first_tables(self) -> pd.DataFrame:
+        """
+        Return the first table ID of each reservation with at least one, with
+        its "number" and "letter", indexed by reservation.
+        """
+        return self.ids.drop_duplicates("reservation").set_index("reservation")
+
+    def joined(self, separator: str = "-") -> pd.Series:
+        """
+        Return the table IDs of each reservation with at least one, joined
+        with `separator`, indexed by reservation.
+        """
+        return self.ids.groupby("reservation", sort=False)["table_id"].agg(separator.join)
+
+    def has_issues(self) -> bool:
+        return bool(self.double_booked) or not self.mismatches.empty or not self.malformed.empty
+
+    def summary(self) -> str:
+        """
+        Return a one line description of the issues found.
+        """
+        if not self.has_issues():
+            return f"{len(self.occupancy)} tables booked, no issues."
+        parts = []
+        if self.double_booked:
+            parts.append(f"{len(self.double_booked)} double-booked")
+        if not self.mismatches.empty:
+            parts.append(f"{len(self.mismatches)} Num tavoli mismatches")
+        if not self.malformed.empty:
+            parts.append(f"{len(self.malformed)} malformed IDs")
+        return f"{len(self.occupancy)} tables booked: " + ", ".join(parts) + "."
+
+    def report(self, names: pd.Series = None) -> str:
+        """
+        Return the list of the issues found, one per line, with the names of
+        the reservations if given (indexed like the dataframe).
+        """
+        def describe(reservation):
+            if names is not None and reservation in names.index:
+                return f"{names[reservation]} (row {reservation})"
+            return f"row {reservation}"
+
+        lines = []
+        for table_id, reservations in sorted(self.double_booked.items()):
+            lines.append(f"Table {table_id} booked by " + ", ".join(describe(r) for r in reservations))
+        for reservation, row in self.mismatches.iterrows():
+            lines.append(f"{describe(reservation)}: Num tavoli {row['declared']}, "
+                         f"{row['listed']} tables listed")
+        for row in self.malformed.itertuples(index=False):
+            lines.append(f"{describe(row.reservation)}: malformed table ID {row.table_id}")
+        return "\n".join(lines)
@@ -0,0 +1,198 @@
+# tasks.py
+
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TaskCancelled(Exception):
+    """
+    Raised inside a worker when the task has been cancelled by the user.
+    """
+
+
+class Task:
+    """
+    Handle of a function running in the background.
+
+    The worker reports progress through `progress()`, which also raises
+    `TaskCancelled` when the user asked to stop, so long operations can be
+    interrupted at their natural checkpoints.
+    """
+    def __init__(self, name, cancellable=True):
+        self.name = name
+        self.cancellable = cancellable
+        self.future = None
+        self.cancel_event = threading.Event()
+        self.progress_queue = queue.Queue()
+
+    def progress(self, done, total, text=""):
+        """
+        Report that `done` out of `total` steps are completed.
+        Called from the worker thread.
+        """
+        self.progress_queue.put((done, total, text))
+        if self.cancel_event.is_set():
+            raise TaskCancelled(f"Task {self.name} cancelled.")
+
+    def cancel(self):
+        """
+        Ask the task to stop. Tasks not started yet are never run.
+        """
+        self.cancel_event.set()
+        if self.future:
+            self.future.cancel()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def is_done(self):
+        return self.future is not None and self.future.done()
+
+
+class TaskRunner:
+    """
+    Run functions in a worker pool and deliver their results on the Tk thread.
+
+    Results, errors and progress are polled with `after()`, so callbacks can
+    safely touch the widgets. Each task is identified by a name: a task with
+    the same name cannot run twice at the same time, and the widgets given at
+    submission are disabled until it completes. A widget locked by several
+    tasks gets its state back when the last of them completes.
+    """
+    def __init__(self, root, max_workers=4, poll_interval=50):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="task")
+        self.tasks = {}
+        # Locked widgets, by path name: (widget, number of tasks, state before).
+        self.locks = {}
+
+    def is_running(self, name):
+        return name in self.tasks
+
+    def submit(self, name, fn, *args, on_done=None, on_error=None,
+               on_progress=None, on_finally=None, lock_widgets=(), cancellable=True, **kwargs):
+        """
+        Run `fn(task, *args, **kwargs)` in the worker pool.
+
+        Args:
+            name (str): Identifier of the action, used to avoid duplicates.
+            fn (callable): The function to run. It receives the `Task` as
+                first argument to report progress and check cancellation.
+            on_done (callable): Called on the Tk thread with the result.
+            on_error (callable): Called on the Tk thread with the exception.
+                Defaults to printing it.
+            on_progress (callable): Called on the Tk thread with
+                (done, total, text) for each progress report.
+            on_finally (callable): Called on the Tk thread after the task
+                completes, whatever the outcome.
+            lock_widgets (iterable): Widgets disabled while the task runs.
+            cancellable (bool): If False, `cancel_all` leaves the task
+                running (e.g. the startup, that the app cannot do without).
+        Returns:
+            Task: The task handle, or None if a task with the same name is
+            already running.
+        """
+        if self.is_running(name):
+            print(f"Task {name} already running.")
+            return None
+
+        task = Task(name, cancellable)
+        lock_widgets = list(lock_widgets)
+        for widget in lock_widgets:
+            self._lock(widget)
+
+        task.future = self.executor.submit(fn, task, *args, **kwargs)
+        self.tasks[name] = task
+
+        callbacks = (on_done, on_error, on_progress, on_finally, lock_widgets)
+        self.root.after(self.poll_interval, self._poll, task, callbacks)
+        return task
+
+    def cancel(self, name):
+        task = self.tasks.get(name)
+        if task:
+            task.cancel()
+
+    def set_state(self, widget, state):
+        """
+        Set the state of a widget, or the state it gets back when the tasks
+        locking it complete, so that a running task keeps it disabled.
+        """
+        key = str(widget)
+        if key in self.locks:
+            _, count, _ = self.locks[key]
+            self.locks[key] = (widget, count, state)
+        else:
+            widget.config(state=state)
+
+    def has_cancellable(self):
+        return any(task.cancellable for task in self.tasks.values())
+
+    def cancel_all(self):
+        """
+        Cancel the running tasks, except the ones submitted as not cancellable.
+        """
+        for task in list(self.tasks.values()):
+            if task.cancellable:
+                task.cancel()
+
+    def shutdown(self):
+        for task in list(self.tasks.values()):
+            task.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _poll(self, task, callbacks):
+        on_done, on_error, on_progress, on_finally, lock_widgets = callbacks
+
+        # Deliver only the most recent progress report.
+        last_progress = None
+        while not task.progress_queue.empty():
+            last_progress = task.progress_queue.get_nowait()
+        if last_progress and on_progress:
+            on_progress(*last_progress)
+
+        if not task.future.done():
+            self.root.after(self.poll_interval, self._poll, task, callbacks)
+            return
+
+        del self.tasks[task.name]
+        for widget in lock_widgets:
+            self._unlock(widget)
+
+        try:
+            if task.future.cancelled():
+                raise TaskCancelled(f"Task {task.name} cancelled.")
+            result = task.future.result()
+        except TaskCancelled as e:
+            print(e)
+        except Exception as e:
+            if on_error:
+                on_error(e)
+            else:
+                print(f"Task {task.name} failed: {e}")
+        else:
+            if on_done:
+                on_done(result)
+        finally:
+            if on_finally:
+                on_finally()
+
+    def _lock(self, widget):
+        key = str(widget)
+        if key in self.locks:
+            _, count, state = self.locks[key]
+        else:
+            count, state = 0, widget.cget("state")
+            widget.config(state="disabled")
+        self.locks[key] = (widget, count + 1, state)
+
+    def _unlock(self, widget):
+        key = str(widget)
+        _, count, state = self.locks[key]
+        if count > 1:
+            self.locks[key] = (widget, count - 1, state)
+        else:
+            del self.locks[key]
+            widget.config(state=state)
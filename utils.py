@@ -1,141 +1,514 @@
 
+import hashlib
 import json
+import multiprocessing
 import os
-import re
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request, AuthorizedSession
-from tkinter import messagebox
-import requests
-import pygsheets
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 import pandas as pd
-from fpdf import FPDF
+import phones
+from files import atomic_path
+from tables import TableAssignments
 
+# The PDF libraries are imported by the functions using them, so that
+# importing this module stays fast.
 
+# Columns kept from the reservation worksheets.
+RESERVATION_COLS = ["Nome", "Telefono", "Num persone", "Num tavoli", "Tavolo/i"]
+OPTIONAL_RESERVATION_COLS = ["Num spiedi"]
+# Columns converted to nullable integers, the others are kept as strings.
+INTEGER_RESERVATION_COLS = ["Num persone", "Num tavoli", "Num spiedi"]
 
-def google_download_worksheet(creds: Credentials, file_id: str, sheet_name: str) -> pd.DataFrame:
+
+# Range of the map in the day worksheets, if not set in the settings.
+DEFAULT_MAP_RANGE = "t1:y43"
+# Labels needed for the process pool to beat rendering in one process: each
+# process imports pandas and FPDF again (measured: 3000 labels take 4.0 s in
+# one process and 5.9 s with 4 processes, 6000 labels 34 s and 8.8 s).
+PARALLEL_MIN_LABELS = 4000
+
+# Header-to-column mapping of each worksheet, keyed by (file_id, sheet_name).
+_header_cache = {}
+
+
+def google_download_worksheet(conn, file_id: str, sheet_name: str,
+                              cache=None, force_refresh=False) -> pd.DataFrame:
     """
     Connect to Google Drive and get the specified worksheet from the Google Sheets
-    file as a pandas dataframe. Also filter out unuseful columns and rows with no
-    table number.
+    file as a pandas dataframe. Only the useful columns are downloaded, and rows
+    with no table number are filtered out.
 
     Args:
+        conn (GoogleConnection): The connection providing the API clients.
         file_id (str): the ID of the Google Sheets file.
         sheet_name (str): the name of the Google Sheets worksheet.
+        cache (WorksheetCache): Optional cache used if the file did not change.
+        force_refresh (bool): Download the worksheet even if it is in cache.
     Returns:
         pd.DataFrame: The dataframe of the specified worksheet.
     """
-    # Connect to Google Drive and get the spreadsheet.
     print(sheet_name)
-    client = pygsheets.authorize(custom_credentials=creds)
-    spreadsheet = client.open_by_key(file_id)
-    sheet = spreadsheet.worksheet_by_title(sheet_name)
+    return google_download_worksheets(
+        conn, file_id, {sheet_name: sheet_name}, cache, force_refresh)[sheet_name]
+
+
+def google_download_worksheets(conn, file_id: str, sheet_names: dict,
+                               cache=None, force_refresh=False) -> dict:
+    """
+    Download several worksheets of the Google Sheets file with a single
+    `values.batchGet` request and convert each one as done by
+    `google_download_worksheet`.
+
+    Only the columns in RESERVATION_COLS and OPTIONAL_RESERVATION_COLS are
+    fetched. Their position is resolved from the header row the first time a
+    worksheet is downloaded and then cached: if the header changed, the
+    mapping is resolved again.
+
+    If a cache is given, the revision of the file is checked first with a
+    metadata request, and the worksheets cached for that revision are not
+    downloaded again.
+
+    The phone numbers of all the worksheets, downloaded or cached, are then
+    normalized to E.164 (see `phones.add_phone_columns`).
+
+    Args:
+        conn (GoogleConnection): The connection providing the API clients.
+        file_id (str): the ID of the Google Sheets file.
+        sheet_names (dict): map from a key (e.g. the day) to the worksheet name.
+        cache (WorksheetCache): Optional cache used if the file did not change.
+        force_refresh (bool): Download the worksheets even if they are in cache.
+    Returns:
+        dict: map from the same keys to the dataframes of the worksheets.
+    """
+    cached = {}
+    if cache:
+        revision = google_get_revision(conn, file_id)
+        if not force_refresh:
+            for key, name in sheet_names.items():
+                df = cache.get(file_id, name, revision)
+                if df is not None:
+                    cached[key] = df
+        sheet_names = {key: name for key, name in sheet_names.items() if key not in cached}
+        if not sheet_names:
+            return {key: phones.add_phone_columns(df) for key, df in cached.items()}
+
+    service = conn.get_sheets_service()
+
+    dfs = _fetch_columns(service, file_id, sheet_names)
+    stale = [key for key, df in dfs.items() if df is None]
+    if stale:
+        print(f"Header changed in {stale}. Resolving the columns again.")
+        dfs.update(_fetch_columns(service, file_id, {key: sheet_names[key] for key in stale}))
+
+    for key, df in dfs.items():
+        if df is None:
+            raise Exception(f"Header of worksheet {sheet_names[key]} changed during the download.")
+        dfs[key] = filter_reservations(df)
+        if cache:
+            cache.put(file_id, sheet_names[key], revision, dfs[key])
+    dfs.update(cached)
+    return {key: phones.add_phone_columns(df) for key, df in dfs.items()}
+
+
+def google_get_revision(conn, file_id: str) -> str:
+    """
+    Get the current revision of a Google Drive file, which changes every time
+    the file is edited.
+
+    Args:
+        conn (GoogleConnection): The connection providing the API clients.
+        file_id (str): the ID of the Google Drive file.
+    Returns:
+        str: The revision of the file.
+    """
+    metadata = conn.get_drive_service().files().get(fileId=file_id, fields="version,modifiedTime").execute()
+    return f"{metadata.get('version')}@{metadata.get('modifiedTime')}"
+
+
+def _resolve_columns(service, file_id: str, sheet_names: dict) -> dict:
+    """
+    Return, for each key of `sheet_names`, the map from the useful column
+    names to their letter. Header rows not in cache are fetched with a single
+    request.
+    """
+    missing = [name for name in set(sheet_names.values())
+               if (file_id, name) not in _header_cache]
+    if missing:
+        response = service.spreadsheets().values().batchGet(
+            spreadsheetId=file_id,
+            ranges=[quote_sheet_name(name) + "!1:1" for name in missing],
+            majorDimension="ROWS").execute()
+        for name, value_range in zip(missing, response.get("valueRanges", [])):
+            header = (value_range.get("values") or [[]])[0]
+            _header_cache[(file_id, name)] = {
+                col: column_letter(header.index(col))
+                for col in RESERVATION_COLS + OPTIONAL_RESERVATION_COLS
+                if col in header}
+
+    return {key: _header_cache[(file_id, name)] for key, name in sheet_names.items()}
+
+
+def _fetch_columns(service, file_id: str, sheet_names: dict) -> dict:
+    """
+    Download only the useful columns of the worksheets with a single request.
+    The header cell of each column is downloaded too and checked against the
+    cached mapping: the dataframe of a worksheet whose header does not match
+    is None and its mapping is removed from the cache.
+    """
+    columns = _resolve_columns(service, file_id, sheet_names)
+    ranges = []
+    for key, name in sheet_names.items():
+        for letter in columns[key].values():
+            ranges.append(f"{quote_sheet_name(name)}!{letter}1:{letter}")
+
+    value_ranges = iter([])
+    if ranges:
+        response = service.spreadsheets().values().batchGet(
+            spreadsheetId=file_id,
+            ranges=ranges,
+            majorDimension="COLUMNS",
+            valueRenderOption="UNFORMATTED_VALUE").execute()
+        value_ranges = iter(response.get("valueRanges", []))
+
+    dfs = {}
+    for key, name in sheet_names.items():
+        data = {col: (next(value_ranges).get("values") or [[]])[0] for col in columns[key]}
+        if any(not values or values[0] != col for col, values in data.items()):
+            _header_cache.pop((file_id, name), None)
+            dfs[key] = None
+            continue
+        data = {col: values[1:] for col, values in data.items()}
+        # The API omits trailing empty cells: pad the columns to the same length.
+        num_rows = max((len(values) for values in data.values()), default=0)
+        dfs[key] = pd.DataFrame({
+            col: values + [""] * (num_rows - len(values)) for col, values in data.items()})
+    return dfs
+
+
+def column_letter(index: int) -> str:
+    """
+    Convert a 0-based column index to its A1 notation letter (0 -> A, 26 -> AA).
+    """
+    letter = ""
+    index += 1
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letter = chr(ord("A") + remainder) + letter
+    return letter
+
 
-    # Convert the worksheet to a pandas dataframe.
-    # TODO: Fix the warning generated by the conversion.
-    df_dump = sheet.get_as_df(include_tailing_empty=False)
+def quote_sheet_name(sheet_name: str) -> str:
+    """
+    Quote a worksheet name to be used in an A1 notation range.
+    """
+    return "'" + sheet_name.replace("'", "''") + "'"
 
-    # Maintain only useful columns.
-    cols = ["Nome", "Telefono", "Num persone", "Num tavoli", "Tavolo/i"]
-    not_manadatory_cols = ["Num spiedi"]
 
-    df = df_dump[cols]
+def filter_reservations(df_dump: pd.DataFrame) -> pd.DataFrame:
+    """
+    Maintain only the useful columns of a reservation worksheet and filter out
+    rows with no table number.
+
+    Args:
+        df_dump (pd.DataFrame): The whole worksheet as a dataframe.
+    Returns:
+        pd.DataFrame: The filtered dataframe.
+    """
+    df = df_dump[RESERVATION_COLS]
     try:
-        df_not_mandatory = df_dump[not_manadatory_cols]
+        df_not_mandatory = df_dump[OPTIONAL_RESERVATION_COLS]
         # Join df and df_not_mandatory
         df = df.join(df_not_mandatory)
     except KeyError as e:
         print(f"Column {e} not found in the dataframe. Continuing.")
 
     # Replace empty strings with pd.NA.
-    df.replace("", pd.NA, inplace=True)
-    # Drop rows with no 'Num tavoli' value.
-    df = df[df["Num tavoli"].notna()]
+    df = df.replace("", pd.NA)
+
+    # Drop rows with no 'Num tavoli' value, before the conversion below so
+    # that a value which is not a number (e.g. "2 tavoli") keeps its row.
+    df = df[df["Num tavoli"].notna()].copy()
+
+    # Use uniform types, the API returns numbers and strings mixed together.
+    for col in df.columns:
+        if col in INTEGER_RESERVATION_COLS:
+            numbers = pd.to_numeric(df[col], errors="coerce")
+            unconverted = df[col][numbers.isna() & df[col].notna()]
+            if not unconverted.empty:
+                print(f"Column {col}: values not converted to a number, left empty: "
+                      + ", ".join(f"row {row} {value!r}" for row, value in unconverted.items()))
+            df[col] = numbers.round().astype("Int64")
+        else:
+            df[col] = df[col].astype("string")
 
     return df
 
 
-def google_generate_pdf_map(creds, file_id, sheet_id, output_dir, filename) -> None:
+# File in the output directory with the revision each map was exported from.
+MAP_REVISIONS_FILE = "map-revisions.json"
+_map_revisions_lock = threading.Lock()
+
+
+def google_generate_pdf_map(conn, file_id, sheet_id, output_dir, filename,
+                            force=False, progress=None, map_range=DEFAULT_MAP_RANGE) -> str:
     """
     Generate a PDF of a specific range from a Google Sheet.
 
+    The export is skipped if the map of this sheet was already exported from
+    the current revision of the spreadsheet. The PDF is streamed to a
+    temporary file, which replaces the output file only once complete.
+
     Args:
+        conn (GoogleConnection): The connection providing the API clients.
         file_id (str): The ID of the Google Sheet file.
         sheet_id (str): The ID of the specific sheet within the Google Sheet file.
         output_dir (str): The directory to save the output files.
         filename (str): The base name of the output files (without extension).
+        force (bool): Export the map even if the spreadsheet did not change.
+        progress (callable): Optional callback called as progress(done, total, text).
+        map_range (str): The range of the map in the sheet, e.g. "t1:y43".
+    Returns:
+        str: The path of the PDF file.
 
     Raises:
         Exception: If there is an issue downloading the PDF or converting it to PNG.
     """
 
-    range = "t1:y43"
     dwn_url = 'https://docs.google.com/spreadsheets/d/' + file_id \
               + '/export?format=pdf&gid=' + sheet_id \
-              + "&range=" + range \
+              + "&range=" + map_range \
               + "&scale=4&fith=true" \
               + "&horizontal_alignment=CENTER&vertical_alignment=TOP" \
               + "&gridlines=false"
 
-    authed_session = AuthorizedSession(creds)
-    if not authed_session:
-        raise Exception("Failed to authenticate with Google.")
-    response = authed_session.get(dwn_url)
-    if response.status_code != 200:
-        raise Exception(
-            f"Failed to download PDF. Status code: {response.status_code}")
-
     # Create the output directory if it doesn't exist.
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-
-    # Output the PDF file.
     pdf_file_path = os.path.join(output_dir, f"{filename}.pdf")
 
-    with open(pdf_file_path, "wb") as f:
-        f.write(response.content)
+    # Skip the export if the spreadsheet did not change since the last one.
+    if progress:
+        progress(0, 3, "Checking map revision...")
+    revision = google_get_revision(conn, file_id)
+    revisions = _load_map_revisions(output_dir)
+    map_key = f"{file_id}/{sheet_id}/{map_range}"
+    if not force and revisions.get(map_key) == revision and os.path.exists(pdf_file_path):
+        print(f"File {pdf_file_path} is up to date.")
+        if progress:
+            progress(3, 3, "Map up to date.")
+        return pdf_file_path
+
+    if progress:
+        progress(1, 3, "Exporting map...")
+    authed_session = conn.get_session()
+    if not authed_session:
+        raise Exception("Failed to authenticate with Google.")
+
+    with authed_session.get(dwn_url, stream=True) as response:
+        if response.status_code != 200:
+            raise Exception(
+                f"Failed to download PDF. Status code: {response.status_code}")
+        if progress:
+            progress(2, 3, "Writing map...")
+
+        # Stream the PDF file to a temporary file, then move it in place.
+        with atomic_path(pdf_file_path) as tmp_path, open(tmp_path, "wb") as f:
+            for chunk in response.iter_content(chunk_size=64 * 1024):
+                f.write(chunk)
+
+    _save_map_revision(output_dir, map_key, revision)
 
     print(f"File {pdf_file_path} written.")
+    if progress:
+        progress(3, 3, "Map written.")
+
+    return pdf_file_path
+
+
+def google_export_all_maps(conn, file_id: str, sheet_ids: dict, output_dir: str,
+                           max_workers: int = 3, force: bool = False, progress=None,
+                           map_ranges: dict = None) -> list:
+    """
+    Export the maps of several days concurrently with `google_generate_pdf_map`.
+    At most `max_workers` exports run at the same time, to stay within the
+    Google quotas. A failed export does not stop the others.
+
+    Args:
+        conn (GoogleConnection): The connection providing the API clients.
+        file_id (str): The ID of the Google Sheet file.
+        sheet_ids (dict): Map from the day to the ID of its sheet.
+        output_dir (str): The directory to save the output files.
+        max_workers (int): Maximum number of concurrent exports.
+        force (bool): Export the maps even if the spreadsheet did not change.
+        progress (callable): Optional callback called as progress(done, total, text).
+        map_ranges (dict): Map from the day to the range of its map, if not
+            the default one.
+    Returns:
+        list: For each day, a dict with keys "day", "path" (None if failed),
+        "seconds" and "error" (None if successful).
+    """
+    def export(day, sheet_id):
+        start = time.perf_counter()
+        try:
+            map_range = (map_ranges or {}).get(day, DEFAULT_MAP_RANGE)
+            path = google_generate_pdf_map(conn, file_id, sheet_id, output_dir, day + "-map",
+                                           force=force, map_range=map_range)
+            error = None
+        except Exception as e:
+            path, error = None, str(e)
+        return {"day": day, "path": path, "seconds": time.perf_counter() - start, "error": error}
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="map") as executor:
+        futures = [executor.submit(export, day, sheet_id) for day, sheet_id in sheet_ids.items()]
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                result = future.result()
+                results[result["day"]] = result
+                if progress:
+                    progress(done, len(futures), f"Map {result['day']} done ({done}/{len(futures)})")
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+
+    results = [results[day] for day in sheet_ids]
+    for result in results:
+        status = "failed: " + result["error"] if result["error"] else "ok"
+        print(f"Map {result['day']}: {status} in {result['seconds']:.1f}s")
+    return results
+
+
+def rasterize_pdf_map(pdf_file_path: str, dpi: int = 200, preview_size: int = 250) -> tuple:
+    """
+    Convert the map PDF to a PNG image, plus a small preview to show in the
+    app. Both images are saved next to the PDF, and rendered again only if
+    the PDF (or the requested resolution) changed.
 
-    # Convert PDF to PNG
-    # pages = convert_from_path(pdf_file_path, dpi=300)
-    # if len(pages) != 1:
-    #     raise Exception(
-    #         "PDF to PNG conversion resulted in more than one page.")
-    # png_file_path = os.path.join(output_dir, f"{filename}.png")
-    # pages[0].save(png_file_path, 'PNG')
+    Args:
+        pdf_file_path (str): Path of the map PDF file.
+        dpi (int): Resolution of the PNG image.
+        preview_size (int): Maximum width and height of the preview, in pixels.
+    Returns:
+        tuple: The paths of the PNG image and of the preview.
 
-    # print(f"File {png_file_path} written.")
+    Raises:
+        Exception: If the PDF has more than one page.
+    """
+    base_path = os.path.splitext(pdf_file_path)[0]
+    png_file_path = base_path + ".png"
+    preview_file_path = base_path + "-preview.png"
+    meta_file_path = base_path + ".png.json"
+
+    with open(pdf_file_path, "rb") as f:
+        pdf_hash = hashlib.sha256(f.read()).hexdigest()
+    meta = {"pdf_hash": pdf_hash, "dpi": dpi, "preview_size": preview_size}
+    try:
+        with open(meta_file_path, 'r') as f:
+            cached_meta = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        cached_meta = None
+    if cached_meta == meta and os.path.exists(png_file_path) and os.path.exists(preview_file_path):
+        print(f"File {png_file_path} is up to date.")
+        return png_file_path, preview_file_path
+
+    import pymupdf
+    with pymupdf.open(pdf_file_path) as doc:
+        if doc.page_count != 1:
+            raise Exception(
+                "PDF to PNG conversion resulted in more than one page.")
+        page = doc[0]
+        page.get_pixmap(dpi=dpi).save(png_file_path)
+        zoom = preview_size / max(page.rect.width, page.rect.height)
+        page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom)).save(preview_file_path)
+
+    with open(meta_file_path, 'w') as f:
+        json.dump(meta, f)
+    print(f"File {png_file_path} written.")
+    return png_file_path, preview_file_path
+
+
+def _load_map_revisions(output_dir: str) -> dict:
+    try:
+        with open(os.path.join(output_dir, MAP_REVISIONS_FILE), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def _save_map_revision(output_dir: str, map_key: str, revision: str) -> None:
+    # Maps can be exported concurrently: update the file one at a time.
+    with _map_revisions_lock:
+        revisions = _load_map_revisions(output_dir)
+        revisions[map_key] = revision
+        path = os.path.join(output_dir, MAP_REVISIONS_FILE)
+        with atomic_path(path) as tmp_path, open(tmp_path, 'w') as f:
+            json.dump(revisions, f, indent=4)
 
 
 def generate_table_labels_pdf(
-        df: pd.DataFrame, filename: str, output_dir: str) -> None:
+        df: pd.DataFrame, filename: str, output_dir: str, progress=None,
+        workers: int = 1, chunk_size: int = 1000, assignments: TableAssignments = None) -> None:
     """
     Generate a PDF containing pages with labels to attach to booked tables.
 
     Precondition:
     This function relies on the "Nome" and "Num tavoli" columns of the DataFrame.
 
+    With more than one worker and at least PARALLEL_MIN_LABELS labels, the
+    sorted labels are split in chunks of `chunk_size` pages, rendered in
+    parallel by a process pool and then merged in order.
+
     Args:
         df (pd.DataFrame): DataFrame containing booking information.
         filename (str): Name of the output PDF file (without extension).
         output_dir (str): Output directory path.
-        booked_table_ids (list): List of booked table IDs.
+        progress (callable): Optional callback called as progress(done, total, text)
+            before each page (after each chunk in parallel mode). It may raise
+            to interrupt the generation.
+        workers (int): Number of processes rendering the pages.
+        chunk_size (int): Number of pages rendered by each process at a time.
+        assignments (TableAssignments): The tables of `df`, if already parsed.
     """
 
-    df = df.dropna(subset=["Tavolo/i"])
-    df = df[df["Tavolo/i"].str.strip() != ""]
+    labels = prepare_labels(df, assignments)
+
+    # Create the output directory if it doesn't exist.
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    pdf_file_path = os.path.join(output_dir, f"{filename}.pdf")
+
+    if workers > 1 and len(labels) >= max(PARALLEL_MIN_LABELS, chunk_size + 1):
+        _render_labels_parallel(labels, pdf_file_path, progress, workers, chunk_size)
+    else:
+        render_labels(labels, pdf_file_path, progress)
+    print(f"File {pdf_file_path} written.")
+    if progress:
+        progress(len(labels), len(labels), "Labels written.")
+
+    return
 
-    # Extract the first table ID from "Tavolo/i" column and add separate columns for sorting
-    df['first_table_id'] = df['Tavolo/i'].apply(lambda x: x.split(";")[0])
-    df['numeric_part'] = df['first_table_id'].apply(lambda x: extract_number_and_letter(x)[0])
-    df['letter_part'] = df['first_table_id'].apply(lambda x: extract_number_and_letter(x)[1])
-    # Sort DataFrame by the numeric and letter parts of the first table ID
-    df = df.sort_values(by=['numeric_part', 'letter_part'])
 
+def render_labels(labels: pd.DataFrame, pdf_file_path: str, progress=None) -> None:
+    """
+    Render a page for each label and write the PDF file.
+
+    Args:
+        labels (pd.DataFrame): The labels, as returned by `prepare_labels`.
+        pdf_file_path (str): Path of the output PDF file.
+        progress (callable): Optional callback called as progress(done, total, text)
+            before each page.
+    """
+    from fpdf import FPDF
     pdf = FPDF(orientation="L", format="A4")
+    total = len(labels)
 
-    for _, row in df.iterrows():
+    for page_num, label in enumerate(labels.itertuples(index=False)):
+        if progress:
+            progress(page_num, total, f"Label {page_num + 1}/{total}")
 
         pdf.add_page()
 
@@ -143,53 +516,173 @@ def generate_table_labels_pdf(
         pdf.set_font('Arial', 'B', 60)
         pdf.cell(w=0, h=40, txt='PRENOTATO', align="C", ln=2)
 
-        name = row['Nome'].upper()
-        tables_num = int(row["Num tavoli"])
-        print(f"Printing page for {name} with {tables_num} tables...")
+        print(f"Printing page for {label.name} with {label.tables_num} tables...")
+        pdf.set_font('Arial', 'B', label.name_font_size)
+        pdf.cell(w=0, h=70, align="C", txt=label.name, ln=2)
 
-        # Adjust font size for the name based on its length
-        name_font_size = 100
-        max_name_length = 10  # Define the maximum length for the name to fit in one line
-        if len(name) > max_name_length:
-            name_font_size = max(30, 100 - (len(name) - max_name_length) * 5)
+        # Number of tables and table IDs combined
+        pdf.set_font('Arial', 'B', 50)
+        pdf.cell(w=0, h=25, align="C", txt=f"{label.tables_num} TAVOL{'I' if label.tables_num > 1 else 'O'}", ln=2)
+        pdf.cell(w=0, h=25, align="C", txt=label.table_ids, ln=2)
 
-        pdf.set_font('Arial', 'B', name_font_size)
-        pdf.cell(w=0, h=70, align="C", txt=name, ln=2)
+        if not pd.isna(label.num_spiedi):
+            pdf.set_font('Arial', 'B', 20)
+            pdf.cell(w=0, h=10, align="C", txt=f"{label.num_spiedi} SPIEDI", ln=2)
 
-        # Number of tables and table IDs
-        try:
-            booked_table_ids = row["Tavolo/i"].split(";")
-        except AttributeError:
-            print(f"Error: Tavolo/i column not found in the row.")
-            booked_table_ids = []
-        table_ids_text = '-'.join(map(str, booked_table_ids))
-        pdf.set_font('Arial', 'B', 50)
+    pdf.output(pdf_file_path, 'F')
 
-        # Number of tables and table IDs combined
-        pdf.cell(w=0, h=25, align="C", txt=f"{tables_num} TAVOL{'I' if tables_num > 1 else 'O'}", ln=2)
-        pdf.cell(w=0, h=25, align="C", txt=table_ids_text,ln=2)
-        pdf.set_font('Arial', 'B', 50)
 
-        # Check if "Num spiedi" column exists
-        if "Num spiedi" in df.columns and not pd.isna(row["Num spiedi"]):
-                num_spiedi = row["Num spiedi"]
-                pdf.set_font('Arial', 'B', 20)
-                pdf.cell(w=0, h=10, align="C", txt=f"{num_spiedi} SPIEDI", ln=2)
+def _render_labels_parallel(labels: pd.DataFrame, pdf_file_path: str, progress,
+                            workers: int, chunk_size: int) -> None:
+    """
+    Render the labels in chunks with a process pool, then merge the partial
+    PDFs in the order of the labels.
+    """
+    chunks = [labels.iloc[i:i + chunk_size] for i in range(0, len(labels), chunk_size)]
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(pdf_file_path) or None) as tmp_dir:
+        part_paths = [os.path.join(tmp_dir, f"part-{i}.pdf") for i in range(len(chunks))]
+
+        # Forking a multi-threaded process (the Tk app runs this from a
+        # worker thread) can deadlock the children: start fresh interpreters.
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = {executor.submit(render_labels, chunk, path): len(chunk)
+                       for chunk, path in zip(chunks, part_paths)}
+            try:
+                done_pages = 0
+                for future in as_completed(futures):
+                    future.result()
+                    done_pages += futures[future]
+                    if progress:
+                        progress(done_pages, len(labels), f"Label {done_pages}/{len(labels)}")
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                raise
+
+        from pypdf import PdfWriter
+        writer = PdfWriter()
+        for path in part_paths:
+            writer.append(path)
+        with open(pdf_file_path, "wb") as f:
+            writer.write(f)
+
+
+def generate_table_labels_pdf_incremental(
+        df: pd.DataFrame, filename: str, output_dir: str, cache_dir: str,
+        progress=None, assignments: TableAssignments = None) -> int:
+    """
+    Generate the same PDF as `generate_table_labels_pdf`, plus
+    "<filename>-delta.pdf" with only the labels new or changed since the
+    previous run, so that they can be printed alone.
+
+    Each label is hashed on its content (name, number of tables, table IDs
+    and number of spiedi), and the hashes of the run are saved in
+    `cache_dir`. The full PDF is rendered in one document like the plain
+    generation, which is faster than merging cached single pages, and the
+    delta is rendered in a second document.
+
+    Args:
+        df (pd.DataFrame): DataFrame containing booking information.
+        filename (str): Name of the output PDF file (without extension).
+        output_dir (str): Output directory path.
+        cache_dir (str): Directory of the hashes of the previous runs.
+        progress (callable): Optional callback called as progress(done, total, text)
+            before each rendered page. It may raise to interrupt the generation.
+        assignments (TableAssignments): The tables of `df`, if already parsed.
+    Returns:
+        int: The number of new or changed labels.
+    """
+    labels = prepare_labels(df, assignments)
+    hashes = [hash_label(label) for label in labels.itertuples(index=False)]
+
+    manifest_dir = os.path.join(cache_dir, filename)
+    os.makedirs(manifest_dir, exist_ok=True)
+    manifest_path = os.path.join(manifest_dir, "manifest.json")
+    try:
+        with open(manifest_path, 'r') as f:
+            previous_hashes = set(json.load(f))
+    except (FileNotFoundError, json.JSONDecodeError):
+        previous_hashes = set()
 
-    # Create the output directory if it doesn't exist.
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
-    # Output the file.
     pdf_file_path = os.path.join(output_dir, f"{filename}.pdf")
-    pdf.output(pdf_file_path, 'F')
+    render_labels(labels, pdf_file_path, progress)
     print(f"File {pdf_file_path} written.")
 
-    return
+    delta = labels[[label_hash not in previous_hashes for label_hash in hashes]]
+    delta_file_path = os.path.join(output_dir, f"{filename}-delta.pdf")
+    if len(delta) == len(labels):
+        # First run, or everything changed: the delta is the full PDF.
+        shutil.copyfile(pdf_file_path, delta_file_path)
+        print(f"File {delta_file_path} written with {len(delta)} labels.")
+    elif not delta.empty:
+        render_labels(delta, delta_file_path)
+        print(f"File {delta_file_path} written with {len(delta)} labels.")
+    elif os.path.exists(delta_file_path):
+        # Do not leave the delta of a previous run around.
+        os.remove(delta_file_path)
+
+    with open(manifest_path, 'w') as f:
+        json.dump(hashes, f)
+    # Drop the single pages cached by the previous versions.
+    for page in os.listdir(manifest_dir):
+        if page.endswith(".pdf"):
+            os.remove(os.path.join(manifest_dir, page))
+
+    if progress:
+        progress(len(labels), len(labels), "Labels written.")
+    return len(delta)
+
+
+def hash_label(label) -> str:
+    """
+    Hash of the content of a label, as returned by `prepare_labels`.
+    """
+    fields = [label.name, label.tables_num, label.table_ids, label.num_spiedi]
+    content = "\x1f".join("" if pd.isna(field) else str(field) for field in fields)
+    return hashlib.sha1(content.encode()).hexdigest()
 
 
-def extract_number_and_letter(value):
-    match = re.match(r"(\d+)([A-Z])", value)
-    if match:
-        number, letter = match.groups()
-        return int(number), letter
-    return 0, ''  # Default return if the pattern does not match
+def prepare_labels(df: pd.DataFrame, assignments: TableAssignments = None) -> pd.DataFrame:
+    """
+    Compute the content of the table labels in a single vectorized pass.
+    Reservations with no table ID are skipped, and the labels are sorted by
+    the first table ID (number, then letter). If "Num tavoli" is missing or
+    not a number, the number of table IDs listed is used instead.
+
+    Args:
+        df (pd.DataFrame): DataFrame containing booking information.
+        assignments (TableAssignments): The tables of `df`, if already parsed.
+    Returns:
+        pd.DataFrame: One row for each label, with columns "name",
+        "name_font_size", "tables_num", "table_ids" and "num_spiedi".
+    """
+    if assignments is None:
+        assignments = TableAssignments(df)
+    first_tables = assignments.first_tables()
+    df = df[df.index.isin(first_tables.index)]
+    first_tables = first_tables.reindex(df.index)
+    name = df["Nome"].astype("string").str.upper().fillna("")
+    tables_num = df["Num tavoli"].astype("Int64")
+    listed = assignments.ids.groupby("reservation", sort=False).size().reindex(df.index)
+    if tables_num.isna().any():
+        print("Num tavoli missing, using the number of tables listed for: "
+              + ", ".join(name[tables_num.isna()]))
+        tables_num = tables_num.fillna(listed.astype("Int64"))
+
+    labels = pd.DataFrame({
+        "name": name,
+        # Shrink the font of the names that do not fit in one line (10 characters).
+        "name_font_size": (100 - (name.str.len() - 10) * 5).clip(30, 100).astype(int),
+        "tables_num": tables_num,
+        "table_ids": assignments.joined("-").reindex(df.index),
+        "num_spiedi": df["Num spiedi"].astype("Int64") if "Num spiedi" in df.columns else pd.NA,
+        "numeric_part": first_tables["number"].fillna(0).astype(int),
+        "letter_part": first_tables["letter"].fillna(""),
+    }, index=df.index)
+
+    labels = labels.sort_values(by=["numeric_part", "letter_part"])
+    return labels.drop(columns=["numeric_part", "letter_part"])
+
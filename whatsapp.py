@@ -0,0 +1,149 @@
+# whatsapp.py
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+GRAPH_API_URL = "https://graph.facebook.com/v20.0"
+# Status codes worth a retry: rate limiting and server errors.
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class RateLimiter:
+    """
+    Token bucket limiting the number of requests per second, shared by the
+    sending threads.
+    """
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """
+        Wait until a request can be sent.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def send_message(conn, phone: str, message: str, rate_limiter: RateLimiter = None,
+                 max_retries: int = 5, backoff: float = 1.0) -> dict:
+    """
+    Send a text message to a phone number, retrying with exponential backoff
+    when the API answers with a rate limit or server error.
+
+    Args:
+        conn (WhatsAppConnection): The connection providing the session.
+        phone (str): The recipient phone number, with country code.
+        message (str): The text of the message.
+        rate_limiter (RateLimiter): Optional limiter shared between the senders.
+        max_retries (int): Maximum number of retries.
+        backoff (float): Wait before the first retry, doubled at each retry.
+    Returns:
+        dict: The result with keys "phone", "status" ("sent" or "failed"),
+        "message_id" and "error".
+    """
+    url = f"{GRAPH_API_URL}/{conn.phone_number_id}/messages"
+    payload = {
+        "messaging_product": "whatsapp",
+        "to": phone,
+        "type": "text",
+        "text": {"body": message},
+    }
+    session = conn.get_session()
+    error = None
+
+    for attempt in range(max_retries + 1):
+        if rate_limiter:
+            rate_limiter.acquire()
+        try:
+            response = session.post(url, json=payload, timeout=30)
+        except Exception as e:
+            # Network errors are retried like server errors.
+            error = str(e)
+            wait = backoff * 2 ** attempt
+        else:
+            if response.status_code == 200:
+                messages = response.json().get("messages") or [{}]
+                return {"phone": phone, "status": "sent",
+                        "message_id": messages[0].get("id"), "error": None}
+            error = f"{response.status_code}: {response.text}"
+            if response.status_code not in RETRY_STATUS_CODES:
+                break
+            wait = backoff * 2 ** attempt
+            retry_after = response.headers.get("Retry-After")
+            if retry_after and retry_after.isdigit():
+                wait = max(wait, int(retry_after))
+        if attempt < max_retries:
+            time.sleep(wait)
+
+    return {"phone": phone, "status": "failed", "message_id": None, "error": error}
+
+
+def send_bulk_messages(conn, phones: list, message: str, rate: float = 20,
+                       max_workers: int = 8, max_retries: int = 5,
+                       on_result=None, progress=None, rate_limiter: RateLimiter = None) -> list:
+    """
+    Send the same text message to many phone numbers concurrently, without
+    exceeding `rate` requests per second.
+
+    Args:
+        conn (WhatsAppConnection): The connection providing the session.
+        phones (list): The recipient phone numbers.
+        message (str): The text of the message.
+        rate (float): Maximum number of requests per second.
+        max_workers (int): Number of concurrent senders.
+        max_retries (int): Maximum number of retries for each message.
+        on_result (callable): Optional callback called with each result as soon
+            as it is known (e.g. to record it in the outbox).
+        progress (callable): Optional callback called as progress(done, total, text).
+        rate_limiter (RateLimiter): Optional limiter shared with other sends
+            running at the same time, used instead of `rate`.
+    Returns:
+        list: The result of `send_message` for each phone, in the same order.
+    """
+    if rate_limiter is None:
+        rate_limiter = RateLimiter(rate, burst=max_workers)
+    results = [None] * len(phones)
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="whatsapp") as executor:
+        futures = {
+            executor.submit(send_message, conn, phone, message, rate_limiter, max_retries): i
+            for i, phone in enumerate(phones)}
+        reported = set()
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                results[futures[future]] = future.result()
+                reported.add(future)
+                if on_result:
+                    on_result(results[futures[future]])
+                if progress:
+                    progress(done, len(phones), f"Sent {done}/{len(phones)}")
+        except BaseException:
+            # Stop sending if interrupted (e.g. cancelled by the user). The
+            # messages already being sent are delivered anyway: wait for them
+            # and report their results, so they are not sent again.
+            for future in futures:
+                future.cancel()
+            for future in futures:
+                if future.cancelled() or future in reported:
+                    continue
+                results[futures[future]] = future.result()
+                if on_result:
+                    on_result(results[futures[future]])
+            raise
+
+    sent = sum(1 for result in results if result["status"] == "sent")
+    print(f"WhatsApp messages sent: {sent}/{len(phones)}.")
+    return results
@@ -0,0 +1,123 @@
+# worksheet_cache.py
+
+import hashlib
+import json
+import os
+import threading
+import time
+import pandas as pd
+from files import atomic_path
+
+
+class WorksheetCache:
+    """
+    On-disk cache of the downloaded worksheets, keyed by file ID and sheet name.
+
+    Each entry stores the revision of the spreadsheet it was downloaded from:
+    an entry is used only if the spreadsheet still has the same revision.
+    The dataframes are saved as parquet files, and an index file keeps track
+    of revisions, sizes and access times to evict old entries.
+    """
+    INDEX_FILE = "index.json"
+
+    def __init__(self, cache_dir="cache", max_age_days=7, max_size_mb=100):
+        self.cache_dir = cache_dir
+        self.max_age = max_age_days * 24 * 3600
+        self.max_size = max_size_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        self.index = self._load_index()
+
+    def get(self, file_id: str, sheet_name: str, revision: str):
+        """
+        Return the cached dataframe of the worksheet, or None if it is not in
+        cache or if it was downloaded from a different revision.
+        """
+        key = self._key(file_id, sheet_name)
+        with self.lock:
+            entry = self.index.get(key)
+            if not entry or entry["revision"] != revision:
+                return None
+            try:
+                df = pd.read_parquet(os.path.join(self.cache_dir, entry["path"]))
+            except Exception as e:
+                print(f"Failed to read cached worksheet {sheet_name}: {e}")
+                self._remove(key)
+                self._save_index()
+                return None
+            entry["last_used"] = time.time()
+            self._save_index()
+        print(f"Worksheet {sheet_name} loaded from cache.")
+        return df
+
+    def put(self, file_id: str, sheet_name: str, revision: str, df: pd.DataFrame) -> None:
+        """
+        Store the dataframe of the worksheet, then evict old entries.
+        """
+        key = self._key(file_id, sheet_name)
+        path = key + ".parquet"
+        with self.lock:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            df.to_parquet(os.path.join(self.cache_dir, path))
+            now = time.time()
+            self.index[key] = {
+                "file_id": file_id,
+                "sheet_name": sheet_name,
+                "revision": revision,
+                "path": path,
+                "size": os.path.getsize(os.path.join(self.cache_dir, path)),
+                "created": now,
+                "last_used": now,
+            }
+            self._evict()
+            self._save_index()
+
+    def clear(self, file_id: str = None) -> None:
+        """
+        Remove all the entries, or only the ones of the given file.
+        """
+        with self.lock:
+            for key, entry in list(self.index.items()):
+                if file_id is None or entry["file_id"] == file_id:
+                    self._remove(key)
+            self._save_index()
+
+    def _evict(self) -> None:
+        """
+        Remove the entries older than the maximum age, then the least recently
+        used ones until the cache fits the maximum size.
+        """
+        now = time.time()
+        for key, entry in list(self.index.items()):
+            if now - entry["created"] > self.max_age:
+                self._remove(key)
+
+        entries = sorted(self.index.items(), key=lambda item: item[1]["last_used"])
+        total_size = sum(entry["size"] for _, entry in entries)
+        for key, entry in entries:
+            if total_size <= self.max_size:
+                break
+            total_size -= entry["size"]
+            self._remove(key)
+
+    def _remove(self, key: str) -> None:
+        entry = self.index.pop(key)
+        try:
+            os.remove(os.path.join(self.cache_dir, entry["path"]))
+        except FileNotFoundError:
+            pass
+
+    def _key(self, file_id: str, sheet_name: str) -> str:
+        return hashlib.sha1(f"{file_id}/{sheet_name}".encode()).hexdigest()
+
+    def _load_index(self) -> dict:
+        try:
+            with open(os.path.join(self.cache_dir, self.INDEX_FILE), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_index(self) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        index_path = os.path.join(self.cache_dir, self.INDEX_FILE)
+        with atomic_path(index_path) as tmp_path, open(tmp_path, 'w') as f:
+            json.dump(self.index, f, indent=4)